@@ -1,35 +1,304 @@
 #!/usr/bin/python
 
+import argparse
+from collections import deque
 import json
-from Queue import Queue
+import struct
 import sys
 import time
 import traceback
-from threading import Thread, Lock
+from threading import Thread, Lock, Condition
 from pyModbusTCP.server import ModbusServer, DataBank
-from pyModbusTCP import utils
+from pyModbusTCP import constants as const
 import serial
 
 
+# some const
+# process values poll period (s)
+POLL_PERIOD = 0.5
+# binary telemetry period pushed by the PID board (ms), 0 for "json" polling
+TELEMETRY_PERIOD = 100
+# telemetry restart if no frame is received for this delay (s)
+TELEMETRY_TIMEOUT = 2.0
+# write area: coils and float registers written by modbus clients are PID board commands
+COILS_CMD = {100: "auto", 101: "man", 110: "save"}
+# pipelined commands: max bytes in flight (the PID board serial rx buffer is 64 bytes)
+PIPELINE_BYTES = 48
+# command reply timeout (s)
+REPLY_TIMEOUT = 2.0
+# PID board reply prefix of every command
+CMD_REPLY = {"json": "{", "stream": "telemetry", "auto": "PID set to auto", "man": "PID set to manual",
+             "out": "PID out", "sp": "PID SetPoint", "kp": "PID kp", "ki": "PID ki", "kd": "PID kd",
+             "save": "Write params"}
+# commands superseded by the next one of the same name (only the last value is sent)
+COALESCE_CMDS = ("sp", "out", "kp", "ki", "kd", "json", "stream")
+
+
 # some function
 def is_nan(x):
     return x != x
 
 
+def fletcher16(data):
+    # Fletcher-16 checksum of a bytearray, return (sum1, sum2)
+    sum1 = sum2 = 0
+    for b in data:
+        sum1 = (sum1 + b) % 255
+        sum2 = (sum2 + sum1) % 255
+    return sum1, sum2
+
+
 # some class
 class ArduinoCommandSerial(serial.Serial):
-    def send_cmd(self, cmd, echo=False):
-        # flush rx buffer
-        self.read(self.inWaiting())
-        # send command
-        self.write(cmd + "\r\n")
-        if echo:
-            print("> %s" % cmd)
-        # receive command return
-        ret = self.readline().strip()
-        if echo:
-            print("< %s" % ret)
-        return ret
+    # text commands ("cmd arg\r\n" -> one text line reply, sent by CommandScheduler) and binary telemetry
+    # frames pushed by the board
+    # frame: sync 0xA5 0x5A, payload length, payload, Fletcher-16 checksum of length and payload
+    # a reader thread (or the event loop) own the rx side: frames are decoded and passed to on_record, text
+    # lines are passed to on_reply
+    SYNC = bytearray(b"\xa5\x5a")
+    TELEM_TYPE_PID = 0x01
+    # type, seq, time (ms), pv, sp, out, kp, ki, kd, flags (little endian AVR)
+    TELEM_STRUCT = struct.Struct("<BBIffffffB")
+
+    def __init__(self, *args, **kwargs):
+        serial.Serial.__init__(self, *args, **kwargs)
+        self.rx_buf = bytearray()
+        self.on_record = None
+        self.on_reply = None
+        self.t_last_record = 0.0
+        self.n_bad_frames = 0
+
+    def start_reader(self, on_record=None, on_reply=None):
+        # telemetry records are passed to on_record and text lines (command replies) to on_reply
+        self.on_record = on_record
+        self.on_reply = on_reply
+        tr = Thread(target=self._reader)
+        # set daemon: reader thread will exit if main thread exit
+        tr.daemon = True
+        tr.start()
+
+    def _reader(self):
+        while True:
+            try:
+                # block until some data (or timeout)
+                self.feed()
+            except Exception:
+                traceback.print_exc(file=sys.stderr)
+                time.sleep(1.0)
+
+    def feed(self):
+        # read available data (at least one byte, or timeout) and process frames and text lines
+        self.rx_buf += self.read(max(1, self.inWaiting()))
+        self._parse()
+
+    def _parse(self):
+        # extract frames and text lines of rx buffer (partial ones are kept for next read)
+        while True:
+            i = self.rx_buf.find(self.SYNC)
+            j = self.rx_buf.find(b"\n")
+            # text line before any frame
+            if j != -1 and (i == -1 or j < i):
+                line = self.rx_buf[:j + 1]
+                del self.rx_buf[:j + 1]
+                # a reply is printable ascii: drop junk up to its last non printable byte (the tail of a frame
+                # when the port is opened mid-frame)
+                k = max([n for n, b in enumerate(line) if not 32 <= b < 127 and b not in (9, 10, 13)] or [-1])
+                line = line[k + 1:].decode("ascii").strip()
+                if line and self.on_reply:
+                    self.on_reply(line)
+                continue
+            # bytes before a frame are not part of a line: drop them
+            if i > 0:
+                del self.rx_buf[:i]
+                i = 0
+            if i == -1 or len(self.rx_buf) < i + 3:
+                return
+            n = self.rx_buf[i + 2]
+            end = i + 3 + n + 2
+            if len(self.rx_buf) < end:
+                return
+            if fletcher16(self.rx_buf[i + 2:i + 3 + n]) == tuple(self.rx_buf[end - 2:end]):
+                self._on_frame(self.rx_buf[i + 3:i + 3 + n])
+                del self.rx_buf[i:end]
+            else:
+                # bad frame: drop it up to next sync bytes (resync if the length byte is corrupted)
+                self.n_bad_frames += 1
+                k = self.rx_buf.find(self.SYNC, i + 1, end)
+                del self.rx_buf[i:end if k == -1 else k]
+
+    def _on_frame(self, payload):
+        if len(payload) == self.TELEM_STRUCT.size and payload[0] == self.TELEM_TYPE_PID:
+            _, seq, t_ms, pv, sp, out, kp, ki, kd, flags = self.TELEM_STRUCT.unpack(bytes(payload))
+            self.t_last_record = time.time()
+            if self.on_record:
+                self.on_record({"auto": flags & 1, "man": flags >> 1 & 1, "pv": pv, "sp": sp, "out": out,
+                                "kp": kp, "ki": ki, "kd": kd, "seq": seq, "t_ms": t_ms})
+
+
+class Command:
+    # a PID board command and its reply callback (reply is "" if lost)
+    def __init__(self, cmd, on_done=None, echo=False):
+        self.cmd = cmd
+        self.name = cmd.split(" ", 1)[0].lower()
+        self.on_done = on_done
+        self.echo = echo
+        self.t_send = 0.0
+
+    def done(self, reply):
+        if self.echo:
+            print("< %s" % reply)
+        if self.on_done:
+            self.on_done(reply)
+
+
+class CommandScheduler:
+    # pipelined and coalescing command queue of the PID board
+    # - a command of COALESCE_CMDS supersede the pending one of the same name: only the last value is sent,
+    #   at the place of the first one, a burst of writes cost one command by name (bounded latency)
+    # - other commands (auto, man, save) are barriers: never coalesced across, never reordered
+    # - urgent commands (process values poll) are sent before the pending ones
+    # - commands are sent without waiting replies while less than PIPELINE_BYTES are in flight, the board
+    #   reply in order with one line by command: a reply is matched to the oldest in flight command of its
+    #   reply prefix (older ones are lost), in flight commands are lost after REPLY_TIMEOUT
+    def __init__(self, link=None, window=PIPELINE_BYTES, timeout=REPLY_TIMEOUT):
+        self.link = link
+        self.window = window
+        self.timeout = timeout
+        self.cond = Condition()
+        self.pending = []
+        self.in_flight = deque()
+        # called on new command or reply (event loop mode, the threaded run() wait on cond)
+        self.wakeup = None
+        self.n_sent = 0
+        self.n_coalesced = 0
+        self.n_lost = 0
+
+    def put(self, cmd, on_done=None, echo=False, urgent=False):
+        # queue a command (thread safe)
+        command = Command(cmd, on_done=on_done, echo=echo)
+        with self.cond:
+            if urgent:
+                self.pending.insert(0, command)
+            elif self._coalesce(command):
+                self.n_coalesced += 1
+            else:
+                self.pending.append(command)
+            self.cond.notify()
+        if self.wakeup:
+            self.wakeup()
+
+    def _coalesce(self, command):
+        # replace the pending command of the same name queued after the last barrier
+        if command.name not in COALESCE_CMDS:
+            return False
+        for i in range(len(self.pending) - 1, -1, -1):
+            if self.pending[i].name not in COALESCE_CMDS:
+                return False
+            if self.pending[i].name == command.name:
+                self.pending[i] = command
+                return True
+        return False
+
+    def busy(self, name):
+        # a command of this name is pending or in flight
+        with self.cond:
+            return any(c.name == name for c in self.pending) or any(c.name == name for c in self.in_flight)
+
+    def on_reply(self, line):
+        # reader thread: match a reply line to the oldest in flight command of its prefix
+        l_done = []
+        with self.cond:
+            for k, command in enumerate(self.in_flight):
+                if line.startswith(CMD_REPLY.get(command.name, "")) or line.startswith("unknown command"):
+                    break
+            else:
+                # unsolicited line
+                return
+            for _ in range(k):
+                l_done.append((self.in_flight.popleft(), ""))
+            self.n_lost += k
+            l_done.append((self.in_flight.popleft(), line))
+            self.cond.notify()
+        for command, reply in l_done:
+            command.done(reply)
+        if self.wakeup:
+            self.wakeup()
+
+    def _pump(self):
+        # (cond locked) expire lost commands and send pending ones as the pipeline window allow,
+        # return lost commands and the next in flight timeout time (None if nothing in flight)
+        l_lost = []
+        now = time.time()
+        if self.in_flight and now - self.in_flight[0].t_send > self.timeout:
+            # no reply: the board dropped them (reset, rx overflow...)
+            l_lost = list(self.in_flight)
+            self.in_flight.clear()
+            self.n_lost += len(l_lost)
+        n_bytes = sum(len(c.cmd) + 2 for c in self.in_flight)
+        while self.pending and (not self.in_flight or n_bytes + len(self.pending[0].cmd) + 2 <= self.window):
+            command = self.pending.pop(0)
+            command.t_send = now
+            self.in_flight.append(command)
+            self.link.write((command.cmd + "\r\n").encode("ascii"))
+            self.n_sent += 1
+            n_bytes += len(command.cmd) + 2
+            if command.echo:
+                print("> %s" % command.cmd)
+        t_timeout = self.in_flight[0].t_send + self.timeout if self.in_flight else None
+        return l_lost, t_timeout
+
+    def pump(self):
+        # event loop mode: send what can be sent now, return the next timeout time (None if nothing in flight)
+        with self.cond:
+            l_lost, t_timeout = self._pump()
+        for command in l_lost:
+            command.done("")
+        return t_timeout
+
+    def run(self, until):
+        # threaded mode: send pending commands as the pipeline window allow and expire lost ones until time until
+        while True:
+            with self.cond:
+                l_lost, t_timeout = self._pump()
+                # wait for a new command, a reply or the next timeout
+                now = time.time()
+                t_wake = until if t_timeout is None else min(until, t_timeout)
+                if not l_lost and t_wake > now:
+                    self.cond.wait(t_wake - now)
+            for command in l_lost:
+                command.done("")
+            if time.time() >= until:
+                return
+
+
+class Layout:
+    # typed layout of a contiguous registers block: list of (name, type), type is a struct code of a
+    # 16 bits (h, H) or 32 bits (f, i, I) value or "bits" for a register of 16 flags (bit 0 first)
+    # 32 bits values are big endian words (most significant word first, like pyModbusTCP utils)
+    def __init__(self, fields):
+        self.names = [name for name, _ in fields]
+        self.types = [t for _, t in fields]
+        self.struct = struct.Struct(">" + "".join("H" if t == "bits" else t for t in self.types))
+        # size in registers and word offset of every field
+        self.size = self.struct.size // 2
+        self.words = struct.Struct(">%dH" % self.size)
+        self.offsets = []
+        offset = 0
+        for t in self.types:
+            self.offsets.append(offset)
+            offset += 1 if t in ("h", "H", "bits") else 2
+
+    def decode(self, word_l):
+        # registers -> {name: value} in one unpack
+        values = self.struct.unpack(self.words.pack(*word_l))
+        return dict((name, [bool(v >> i & 1) for i in range(16)] if t == "bits" else v)
+                    for name, t, v in zip(self.names, self.types, values))
+
+    def encode(self, d_values):
+        # {name: value} -> registers in one pack
+        values = [sum(1 << i for i, bit in enumerate(d_values[name]) if bit) if t == "bits" else d_values[name]
+                  for name, t in zip(self.names, self.types)]
+        return list(self.words.unpack(self.struct.pack(*values)))
 
 
 class DB(DataBank):
@@ -37,20 +306,37 @@ class DB(DataBank):
     def get_floats(cls, address, number=1):
         reg_l = cls.get_words(address, number * 2)
         if reg_l:
-            return [utils.decode_ieee(f) for f in utils.word_list_to_long(reg_l)]
+            return list(struct.unpack(">%df" % number, struct.pack(">%dH" % len(reg_l), *reg_l)))
         else:
             return None
 
     @classmethod
     def set_floats(cls, address, floats_list):
-        b32_l = [utils.encode_ieee(f) for f in floats_list]
-        b16_l = utils.long_list_to_word(b32_l)
-        return cls.set_words(address, b16_l)
+        b16_l = struct.unpack(">%dH" % (len(floats_list) * 2), struct.pack(">%df" % len(floats_list), *floats_list))
+        return cls.set_words(address, list(b16_l))
+
+    @classmethod
+    def get_block(cls, address, layout):
+        # read a whole registers block at once, return a {name: value} dict (None if out of range)
+        reg_l = cls.get_words(address, layout.size)
+        if reg_l:
+            return layout.decode(reg_l)
+        else:
+            return None
+
+    @classmethod
+    def set_block(cls, address, layout, d_values):
+        # write a whole registers block at once from a {name: value} dict
+        return cls.set_words(address, layout.encode(d_values))
 
 
 class Tags:
     lock = Lock()
-    cmd_q = Queue()
+    # written words of the write area floats not yet complete ({float address: set of word addresses})
+    half_floats = {}
+    # binary telemetry on (cleared if the board don't support it) and time of the last start command
+    STREAM = bool(TELEMETRY_PERIOD)
+    T_STREAM_CMD = 0.0
     AUTO = False
     MAN = False
     PV = 0.0
@@ -61,101 +347,289 @@ class Tags:
     KD = 0.0
 
 
+class ModbusTCPProtocol:
+    # asyncio protocol of a modbus TCP client connection (event loop mode): every complete request is
+    # processed at once in the event loop, no thread by client
+    def __init__(self):
+        self.transport = None
+        self.rx_buf = bytearray()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        self.rx_buf += data
+        while len(self.rx_buf) >= 7:
+            tr_id, pr_id, length, unit_id = struct.unpack(">HHHB", bytes(self.rx_buf[:7]))
+            # close connection if frame header content inconsistency
+            if not (pr_id == 0 and 2 < length < 256):
+                self.transport.close()
+                return
+            if len(self.rx_buf) < 6 + length:
+                return
+            pdu = bytes(self.rx_buf[7:6 + length])
+            del self.rx_buf[:6 + length]
+            tx_pdu = modbus_pdu(pdu)
+            self.transport.write(struct.pack(">HHHB", tr_id, 0, len(tx_pdu) + 1, unit_id) + tx_pdu)
+
+    def eof_received(self):
+        return False
+
+    def connection_lost(self, exc):
+        self.transport = None
+
+    def pause_writing(self):
+        pass
+
+    def resume_writing(self):
+        pass
+
+
+class AsyncGateway:
+    # event loop mode (python 3): modbus TCP clients, serial port rx (add_reader on its file descriptor),
+    # commands scheduler and process values polls are callbacks of one asyncio loop, so there is no
+    # thread to synchronize and a request is served in the loop iteration it is received
+    def __init__(self, loop, link):
+        self.loop = loop
+        self.link = link
+        self.h_pump = None
+        self.h_timeout = None
+        # non-blocking serial reads, rx data is processed as soon as the fd is readable
+        link.timeout = 0
+        link.on_record = update_tags
+        link.on_reply = cmd_sched.on_reply
+        cmd_sched.link = link
+        cmd_sched.wakeup = self.wakeup
+        loop.add_reader(link.fileno(), link.feed)
+
+    def wakeup(self):
+        # one scheduler pump for all commands and replies of a loop iteration
+        if self.h_pump is None:
+            self.h_pump = self.loop.call_soon(self.pump)
+
+    def pump(self):
+        self.h_pump = None
+        t_timeout = cmd_sched.pump()
+        if self.h_timeout:
+            self.h_timeout.cancel()
+            self.h_timeout = None
+        if t_timeout is not None:
+            self.h_timeout = self.loop.call_later(max(0.0, t_timeout - time.time()), self.pump)
+
+    def poll(self):
+        self.loop.call_later(POLL_PERIOD, self.poll)
+        queue_poll(self.link)
+
+
+# registers blocks: read area @0 (PID values) and write area @100 (commands, field name is the command)
+READ_LAYOUT = Layout([("pv", "f"), ("sp", "f"), ("out", "f"), ("kp", "f"), ("ki", "f"), ("kd", "f")])
+WRITE_LAYOUT = Layout([("sp", "f"), ("out", "f"), ("kp", "f"), ("ki", "f"), ("kd", "f")])
+WRITE_ADDR = 100
+# PID board commands of modbus writes and process values polls
+cmd_sched = CommandScheduler()
+
+
 # some functions
-def mbus_data_thread():
-    # init some value at startup
-    DB.set_bits(100, [False] * 20)
-    DB.set_floats(100, [float("nan")] * 20)
-    # update loop
-    while True:
-        # read commands (auto, manu...)
-        # auto
-        if DB.get_bits(100)[0]:
-            DB.set_bits(100, [False])
-            Tags.cmd_q.put("auto")
-        # manu
-        if DB.get_bits(101)[0]:
-            DB.set_bits(101, [False])
-            Tags.cmd_q.put("man")
-        # save
-        if DB.get_bits(110)[0]:
-            DB.set_bits(110, [False])
-            Tags.cmd_q.put("save")
-        # set-point update
-        sp_value = DB.get_floats(100)[0]
-        if not is_nan(sp_value):
-            DB.set_floats(100, [float('nan')])
-            Tags.cmd_q.put("sp %.2f" % sp_value)
-        # output update for manual mode
-        out_value = DB.get_floats(102)[0]
-        if not is_nan(out_value):
-            DB.set_floats(102, [float('nan')])
-            Tags.cmd_q.put("out %.2f" % out_value)
-        # set kp params
-        kp_value = DB.get_floats(104)[0]
-        if not is_nan(kp_value):
-            DB.set_floats(104, [float('nan')])
-            Tags.cmd_q.put("kp %.2f" % kp_value)
-        # set ki params
-        ki_value = DB.get_floats(106)[0]
-        if not is_nan(ki_value):
-            DB.set_floats(106, [float('nan')])
-            Tags.cmd_q.put("ki %.2f" % ki_value)
-        # set kd params
-        kd_value = DB.get_floats(108)[0]
-        if not is_nan(kd_value):
-            DB.set_floats(108, [float('nan')])
-            Tags.cmd_q.put("kd %.2f" % kd_value)
-        # refresh PID status
-        with Tags.lock:
-            coils_l = [Tags.AUTO, Tags.MAN]
-        DB.set_bits(0, coils_l)
-        # refresh PID values
-        with Tags.lock:
-            write_l = [Tags.PV, Tags.SP, Tags.OUT, Tags.KP, Tags.KI, Tags.KD]
-        DB.set_floats(0, write_l)
-        # wait next loop
-        time.sleep(0.5)
+def on_bits_write(address, bit_list):
+    # coils write: queue command of every set coil of the write area and reset it
+    for addr, bit in enumerate(bit_list, address):
+        if bit and addr in COILS_CMD:
+            DB.set_bits(addr, [False])
+            cmd_sched.put(COILS_CMD[addr], echo=True)
+
+
+def on_words_write(address, word_list):
+    # registers write: queue command of every float of the write area once its 2 words are written (in one
+    # write or by 2 single register writes) and reset it to nan, the write area is read and decoded once
+    if address >= WRITE_ADDR + WRITE_LAYOUT.size or address + len(word_list) <= WRITE_ADDR:
+        return
+    l_complete = []
+    with Tags.lock:
+        for name, offset in zip(WRITE_LAYOUT.names, WRITE_LAYOUT.offsets):
+            f_addr = WRITE_ADDR + offset
+            words = set(range(max(address, f_addr), min(address + len(word_list), f_addr + 2)))
+            if words:
+                words |= Tags.half_floats.pop(f_addr, set())
+                if len(words) == 2:
+                    l_complete.append((name, f_addr))
+                else:
+                    Tags.half_floats[f_addr] = words
+    if not l_complete:
+        return
+    d_values = DB.get_block(WRITE_ADDR, WRITE_LAYOUT)
+    for name, f_addr in l_complete:
+        if not is_nan(d_values[name]):
+            DB.set_floats(f_addr, [float("nan")])
+            cmd_sched.put("%s %.2f" % (name, d_values[name]), echo=True)
+
+
+def update_tags(d):
+    # update tags and modbus read area from PID board values (json reply or telemetry record)
+    with Tags.lock:
+        Tags.AUTO = bool(d["auto"])
+        Tags.MAN = bool(d["man"])
+        Tags.PV = float(d["pv"])
+        Tags.OUT = float(d["out"])
+        Tags.SP = float(d["sp"])
+        Tags.KP = float(d["kp"])
+        Tags.KI = float(d["ki"])
+        Tags.KD = float(d["kd"])
+        coils_l = [Tags.AUTO, Tags.MAN]
+        d_values = {"pv": Tags.PV, "sp": Tags.SP, "out": Tags.OUT, "kp": Tags.KP, "ki": Tags.KI, "kd": Tags.KD}
+    DB.set_bits(0, coils_l)
+    DB.set_block(0, READ_LAYOUT, d_values)
+
+
+def on_json_reply(reply):
+    # process values poll reply
+    if reply:
+        try:
+            update_tags(json.loads(reply))
+        except ValueError:
+            traceback.print_exc(file=sys.stderr)
+
+
+def on_stream_reply(reply):
+    # telemetry start reply: fall back to "json" polls only if the board don't know the command, a lost
+    # reply (board booting or resetting) is retried
+    if reply.startswith("unknown command"):
+        Tags.STREAM = False
+
+
+def queue_poll(link):
+    # binary telemetry: start it at startup and restart it every TELEMETRY_TIMEOUT while the board don't
+    # push frames (reset...)
+    now = time.time()
+    streaming = now - link.t_last_record < TELEMETRY_TIMEOUT
+    retry = now - Tags.T_STREAM_CMD > TELEMETRY_TIMEOUT
+    if Tags.STREAM and not streaming and retry and not cmd_sched.busy("stream"):
+        Tags.T_STREAM_CMD = now
+        cmd_sched.put("stream %d" % TELEMETRY_PERIOD, on_done=on_stream_reply, echo=True, urgent=True)
+    # without telemetry frames the board is polled with "json": one poll by period is sent before pending
+    # commands, so a write burst never stall process values
+    if not streaming and not cmd_sched.busy("json"):
+        cmd_sched.put("json", on_done=on_json_reply, urgent=True)
+
+
+def modbus_pdu(pdu):
+    # process a modbus request PDU on the data bank (event loop mode), return the response PDU
+    # same functions and checks as the pyModbusTCP server, writes go through the hooked DataBank methods
+    fc = bytearray(pdu[:1])[0]
+    exp_status = const.EXP_NONE
+    try:
+        if fc in (const.READ_COILS, const.READ_DISCRETE_INPUTS):
+            address, count = struct.unpack(">HH", pdu[1:5])
+            bits_l = DB.get_bits(address, count) if 0x0001 <= count <= 0x07D0 else None
+            if bits_l:
+                bytes_l = bytearray((count + 7) // 8)
+                for i, bit in enumerate(bits_l):
+                    if bit:
+                        bytes_l[i // 8] |= 1 << (i % 8)
+                return struct.pack("BB", fc, len(bytes_l)) + bytes(bytes_l)
+            exp_status = const.EXP_DATA_ADDRESS if 0x0001 <= count <= 0x07D0 else const.EXP_DATA_VALUE
+        elif fc in (const.READ_HOLDING_REGISTERS, const.READ_INPUT_REGISTERS):
+            address, count = struct.unpack(">HH", pdu[1:5])
+            words_l = DB.get_words(address, count) if 0x0001 <= count <= 0x007D else None
+            if words_l:
+                return struct.pack(">BB%dH" % count, fc, count * 2, *words_l)
+            exp_status = const.EXP_DATA_ADDRESS if 0x0001 <= count <= 0x007D else const.EXP_DATA_VALUE
+        elif fc == const.WRITE_SINGLE_COIL:
+            address, value = struct.unpack(">HH", pdu[1:5])
+            if DB.set_bits(address, [value == 0xFF00]):
+                return pdu[:5]
+            exp_status = const.EXP_DATA_ADDRESS
+        elif fc == const.WRITE_SINGLE_REGISTER:
+            address, value = struct.unpack(">HH", pdu[1:5])
+            if DB.set_words(address, [value]):
+                return pdu[:5]
+            exp_status = const.EXP_DATA_ADDRESS
+        elif fc == const.WRITE_MULTIPLE_COILS:
+            address, count, byte_count = struct.unpack(">HHB", pdu[1:6])
+            if 0x0001 <= count <= 0x07B0 and byte_count == (count + 7) // 8 == len(pdu) - 6:
+                bytes_l = bytearray(pdu[6:])
+                if DB.set_bits(address, [bool(bytes_l[i // 8] >> (i % 8) & 1) for i in range(count)]):
+                    return struct.pack(">BHH", fc, address, count)
+                exp_status = const.EXP_DATA_ADDRESS
+            else:
+                exp_status = const.EXP_DATA_VALUE
+        elif fc == const.WRITE_MULTIPLE_REGISTERS:
+            address, count, byte_count = struct.unpack(">HHB", pdu[1:6])
+            if 0x0001 <= count <= 0x007B and byte_count == count * 2 == len(pdu) - 6:
+                if DB.set_words(address, list(struct.unpack(">%dH" % count, pdu[6:]))):
+                    return struct.pack(">BHH", fc, address, count)
+                exp_status = const.EXP_DATA_ADDRESS
+            else:
+                exp_status = const.EXP_DATA_VALUE
+        else:
+            exp_status = const.EXP_ILLEGAL_FUNCTION
+    except struct.error:
+        exp_status = const.EXP_DATA_VALUE
+    return struct.pack("BB", fc | 0x80, exp_status)
+
+
+def write_hook(set_data, on_write):
+    # wrap a DataBank write class method: on_write is called after every successful write
+    def hooked_set_data(cls, address, data):
+        ret = set_data(address, data)
+        if ret:
+            on_write(address, data)
+        return ret
+    return classmethod(hooked_set_data)
+
+
+def install_write_hooks():
+    # modbus server store client writes with DataBank class methods: hook them to forward commands
+    # as soon as they are written (no polling of the write area)
+    DataBank.set_bits = write_hook(DataBank.set_bits, on_bits_write)
+    DataBank.set_words = write_hook(DataBank.set_words, on_words_write)
 
 
 # main program
 if __name__ == "__main__":
-    # init and start modbus data manager
-    tp = Thread(target=mbus_data_thread)
-    # set daemon: polling thread will exit if main thread exit
-    tp.daemon = True
-    tp.start()
+    # parse command line
+    parser = argparse.ArgumentParser(description="Modbus TCP gateway of the PID air flow board")
+    parser.add_argument("-a", "--asyncio", action="store_true",
+                        help="serve modbus and serial port in one asyncio event loop (python 3)")
+    parser.add_argument("-p", "--port", type=int, default=502, help="modbus TCP port (default: 502)")
+    args = parser.parse_args()
 
-    # init and start modbus server(remain this after modbus data manager init)
-    server = ModbusServer(host="0.0.0.0", port=502, no_block=True)
-    server.start()
+    # forward modbus writes on the fly, init write area (read as nan until a client write a command)
+    install_write_hooks()
+    DB.set_bits(100, [False] * 20)
+    DB.set_floats(WRITE_ADDR, [float("nan")] * 20)
 
     # init serial port
     s = ArduinoCommandSerial("/dev/ttyATH0", baudrate=9600, timeout=2.0)
 
+    # event loop mode: no thread, the loop run forever
+    if args.asyncio:
+        import asyncio
+        loop = asyncio.new_event_loop()
+        gateway = AsyncGateway(loop, s)
+        loop.run_until_complete(loop.create_server(ModbusTCPProtocol, host="0.0.0.0", port=args.port))
+        gateway.poll()
+        loop.run_forever()
+        sys.exit(0)
+
+    # init and start modbus server(remain this after modbus data manager init)
+    server = ModbusServer(host="0.0.0.0", port=args.port, no_block=True)
+    server.start()
+
+    # telemetry records update tags and text replies are matched to commands as soon as they are received
+    cmd_sched.link = s
+    s.start_reader(on_record=update_tags, on_reply=cmd_sched.on_reply)
+
     # init PID board
-    # s.send_cmd("auto", echo=True)
+    # cmd_sched.put("auto", echo=True)
 
     # main loop
+    t_poll = time.time()
     while True:
-        # process pending command
-        while not Tags.cmd_q.empty():
-            cmd = Tags.cmd_q.get()
-            s.send_cmd(cmd, echo=True)
-        # read process values
+        # forward modbus commands (coalesced and pipelined) and match replies until next process values poll
         try:
-            json_msg = s.send_cmd("json")
-            d = json.loads(json_msg)
-            with Tags.lock:
-                Tags.AUTO = float(d["auto"])
-                Tags.MAN = float(d["man"])
-                Tags.PV = float(d["pv"])
-                Tags.OUT = float(d["out"])
-                Tags.SP = float(d["sp"])
-                Tags.KP = float(d["kp"])
-                Tags.KI = float(d["ki"])
-                Tags.KD = float(d["kd"])
+            cmd_sched.run(until=t_poll)
         except Exception as e:
             traceback.print_exc(file=sys.stderr)
-        # wait next loop
-        time.sleep(0.5)
+            time.sleep(1.0)
+        t_poll = time.time() + POLL_PERIOD
+        queue_poll(s)
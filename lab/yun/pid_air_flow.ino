@@ -11,6 +11,10 @@
     - "MAN" for set PID to manual mode, "AUTO" for automatic mode, "SP 34.2" for fix setpoint at 34.2
     - "KP 2.55" to set kp at 2.55, "KI 2" ti set ki at 2.0, "KD 0.2" to set kd at 0.2
     - "SAVE" write currents params (SP, kp, ki and kd) to EEPROM
+    - "STREAM 100" push binary telemetry frames every 100 ms, "STREAM 0" to stop
+
+    Telemetry frame (little endian) : 0xA5 0x5A, payload length, payload, Fletcher-16 of length and payload
+    - payload : type (0x01), seq (uint8), time (uint32 ms), pv, sp, out, kp, ki, kd (float), flags (bit 0 auto, bit 1 man)
 
     This code is licensed under the MIT license : http://opensource.org/licenses/MIT
 */
@@ -38,6 +42,11 @@
 // LCD display
 #define LCD_LINE_SIZE       20
 #define MAX_CMD_SIZE        64
+// binary telemetry
+#define TELEM_SYNC_1        0xA5
+#define TELEM_SYNC_2        0x5A
+#define TELEM_TYPE_PID      0x01
+#define TELEM_MIN_PERIOD    40
 // EEPROM storage
 #define EEPROM_MAGIC_NB     0xAA55
 #define EEPROM_AD_MAGIG_NB  0
@@ -52,6 +61,20 @@ struct PidParams {
   double kd = 0.0;
 };
 
+// telemetry record (double is 32 bits float on AVR)
+struct __attribute__((packed)) TelemRecord {
+  uint8_t type;
+  uint8_t seq;
+  uint32_t t_ms;
+  float pv;
+  float sp;
+  float out;
+  float kp;
+  float ki;
+  float kd;
+  uint8_t flags;
+};
+
 // some vars
 // LCD: address to 0x27 for a 20 chars and 4 line display
 LiquidCrystal_I2C lcd(0x27, 20, 4);
@@ -68,11 +91,13 @@ Scheduler runner;
 void task_serial_command();
 void task_lcd();
 void task_pid();
+void task_telemetry();
 
 // some tasks
 Task t_cmd(1, TASK_FOREVER, &task_serial_command, &runner, true);
 Task t_lcd(200 * TASK_MILLISECOND, TASK_FOREVER, &task_lcd, &runner, true);
 Task t_pid(1 * TASK_SECOND, TASK_FOREVER, &task_pid, &runner, true);
+Task t_telem(100 * TASK_MILLISECOND, TASK_FOREVER, &task_telemetry, &runner, false);
 
 // print msg on line nb on LCD panel
 // pad the line with space char
@@ -87,6 +112,28 @@ void lcd_line(byte line, String msg) {
     lcd.write(' ');
 }
 
+// read air flow in m3/h
+float read_flow() {
+  float ecv_v = 5.0 * analogRead(FLOW_INPUT) / 1024;
+  return ((ecv_v - 0.4) * 25) / 1.6;
+}
+
+// send a binary frame: sync bytes, payload length, payload and Fletcher-16 checksum of length + payload
+void send_frame(const uint8_t *payload, uint8_t len) {
+  uint8_t sum1 = len;
+  uint8_t sum2 = len;
+  for (uint8_t i = 0; i < len; i++) {
+    sum1 = (sum1 + payload[i]) % 255;
+    sum2 = (sum2 + sum1) % 255;
+  }
+  SERIAL_CMD.write(TELEM_SYNC_1);
+  SERIAL_CMD.write(TELEM_SYNC_2);
+  SERIAL_CMD.write(len);
+  SERIAL_CMD.write(payload, len);
+  SERIAL_CMD.write(sum1);
+  SERIAL_CMD.write(sum2);
+}
+
 void task_serial_command() {
   // local static vars
   static String cmd_rx_buf = "";
@@ -159,6 +206,24 @@ void task_serial_command() {
       root.printTo(SERIAL_CMD);
       SERIAL_CMD.println();
     }
+    else if (s_cmd.equals("stream")) {
+      if (! s_arg.equals("")) {
+        long period = s_arg.toInt();
+        if (period <= 0)
+          t_telem.disable();
+        else {
+          t_telem.setInterval(max(period, TELEM_MIN_PERIOD) * TASK_MILLISECOND);
+          t_telem.enable();
+        }
+      }
+      if (t_telem.isEnabled()) {
+        SERIAL_CMD.print(F("telemetry period = "));
+        SERIAL_CMD.print(t_telem.getInterval());
+        SERIAL_CMD.println(F(" ms"));
+      }
+      else
+        SERIAL_CMD.println(F("telemetry off"));
+    }
     else if (s_cmd.equals("pid")) {
       String pid_mode = (myPID.GetMode() == AUTOMATIC) ? "AUT" : "MAN";
       SERIAL_CMD.println("SP  " + String(pid_sp) + " m3/h");
@@ -245,8 +310,7 @@ void task_lcd() {
 
 void task_pid() {
   // read air flow (process value)
-  float ecv_v = 5.0 * analogRead(FLOW_INPUT) / 1024;
-  pid_pv = ((ecv_v - 0.4) * 25) / 1.6;
+  pid_pv = read_flow();
   // update PID
   myPID.SetTunings(pid_p.kp, pid_p.ki, pid_p.kd);
   myPID.Compute();
@@ -254,6 +318,23 @@ void task_pid() {
   analogWrite(OUT_PWM, map(pid_out, 0.0, 100.0, 0, 255));
 }
 
+void task_telemetry() {
+  // push a telemetry record (process value is sampled at telemetry rate)
+  static uint8_t seq = 0;
+  TelemRecord rec;
+  rec.type = TELEM_TYPE_PID;
+  rec.seq = seq++;
+  rec.t_ms = millis();
+  rec.pv = read_flow();
+  rec.sp = pid_sp;
+  rec.out = pid_out;
+  rec.kp = pid_p.kp;
+  rec.ki = pid_p.ki;
+  rec.kd = pid_p.kd;
+  rec.flags = (myPID.GetMode() == AUTOMATIC) | ((myPID.GetMode() == MANUAL) << 1);
+  send_frame((uint8_t *) &rec, sizeof(rec));
+}
+
 
 void setup() {
   // init serial
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+from influx_fetch import chunks_to_arrays
+from signal_builder import sin_signal
+from spectrum import fft_amplitude, find_peaks, normalize
+
+
+# some const
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+STAGES = ("decode", "fft", "normalize", "peaks")
+
+
+# some functions
+def build_response(t_samples, y_samples, chunk_size=10000):
+    # synthetic influxdb chunked response (json lines, newest point first like analyzers queries)
+    fields = ["f%d" % i for i in range(len(y_samples))]
+    rows = np.column_stack((t_samples, y_samples.T))[::-1].tolist()
+    return fields, [json.dumps({"results": [{"statement_id": 0, "series": [
+        {"name": "test", "columns": ["time"] + fields, "values": rows[i:i + chunk_size]}]}]})
+        for i in range(0, len(rows), chunk_size)]
+
+
+def run_case(nb, noise, n_series, ts=1, repeat=5, seed=0):
+    # time every stage of the pipeline on a synthetic signal, return median times (in s) by stage
+    rng = np.random.default_rng(seed)
+    t_samples = np.arange(nb, dtype=np.int64) * ts
+    y_samples = np.round(np.vstack([sin_signal(t_samples, noise=noise, rng=rng) for _ in range(n_series)]), 2)
+    fields, lines = build_response(t_samples, y_samples)
+    d_times = {stage: [] for stage in STAGES}
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        _, y = chunks_to_arrays((json.loads(line)["results"][0] for line in lines), fields,
+                                size_hint=nb, descending=True)
+        t1 = time.perf_counter()
+        xf, ya = fft_amplitude(y, ts)
+        t2 = time.perf_counter()
+        ya = normalize(ya)
+        t3 = time.perf_counter()
+        l_peaks = find_peaks(xf, ya)
+        t4 = time.perf_counter()
+        for stage, dt in zip(STAGES, (t1 - t0, t2 - t1, t3 - t2, t4 - t3)):
+            d_times[stage].append(dt)
+    # sanity check: decoded data must match the signal
+    if not np.allclose(y, y_samples):
+        raise RuntimeError("decoded data mismatch")
+    return {stage: float(np.median(l_t)) for stage, l_t in d_times.items()}, l_peaks[0]
+
+
+# main program
+if __name__ == "__main__":
+    # parse command line
+    parser = argparse.ArgumentParser(description="benchmark stability_checker pipeline stages on synthetic signals")
+    parser.add_argument("-n", "--lengths", type=int, nargs="+", default=[400, 4000, 40000, 400000],
+                        help="signal lengths in samples (default: 400 4000 40000 400000)")
+    parser.add_argument("--noise", type=float, nargs="+", default=[0.0, 20.0, 100.0],
+                        help="noise standard deviations (default: 0 20 100)")
+    parser.add_argument("-s", "--series", type=int, default=1, help="number of series by batch (default: 1)")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="runs by case, median is kept (default: 5)")
+    parser.add_argument("-b", "--baseline", default=BASELINE_FILE, help="baseline json file")
+    parser.add_argument("--save", action="store_true", help="store results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="allowed slowdown vs baseline before failure (default: 0.5 = +50%%)")
+    parser.add_argument("--min-delta", type=float, default=1e-4,
+                        help="ignore slowdowns smaller than this (in s, default: 1e-4)")
+    args = parser.parse_args()
+
+    # load baseline
+    d_baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            d_baseline = json.load(f)
+
+    # run all cases
+    d_results = {}
+    l_regressions = []
+    print("%-32s %10s %10s %10s %10s  %s" % (("case",) + STAGES + ("main peaks",)))
+    for nb in args.lengths:
+        for noise in args.noise:
+            case = "n=%d,noise=%g,series=%d" % (nb, noise, args.series)
+            d_times, peaks = run_case(nb, noise, args.series, repeat=args.repeat)
+            d_results[case] = d_times
+            top = peaks[np.argsort(peaks[:, 1])[::-1]][:3]
+            print("%-32s %10.6f %10.6f %10.6f %10.6f  %s" % ((case,) + tuple(d_times[s] for s in STAGES) +
+                                                              (", ".join("%.4f Hz" % f for f, _ in top),)))
+            # compare with baseline
+            for stage in STAGES:
+                ref = d_baseline.get(case, {}).get(stage)
+                if ref is not None and d_times[stage] > ref * (1 + args.tolerance) \
+                        and d_times[stage] - ref > args.min_delta:
+                    l_regressions.append("%s %s: %.6f s vs baseline %.6f s" % (case, stage, d_times[stage], ref))
+
+    # store or check
+    if args.save:
+        d_baseline.update(d_results)
+        with open(args.baseline, "w") as f:
+            json.dump(d_baseline, f, indent=2, sort_keys=True)
+        print("baseline saved to %s" % args.baseline)
+    elif not d_baseline:
+        print("no baseline found (run with --save to create one)", file=sys.stderr)
+    for msg in l_regressions:
+        print("regression: %s" % msg, file=sys.stderr)
+    exit(1 if l_regressions and not args.save else 0)
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import glob
+import os
+import numpy as np
+from influx_fetch import fetch_fields
+
+
+# some const
+SOURCE_SCHEMES = "influx://host:port/db, npy:DIR, csv:DIR, sqlite:FILE or mem:"
+
+
+# some functions
+def add_source_argument(parser, default="influx://localhost:8086/mydb", description="data source"):
+    # --source option (url of open_source) of command line tools
+    if default:
+        help_msg = "%s: %s (default: %s)" % (description, SOURCE_SCHEMES, default)
+    else:
+        help_msg = "%s (%s)" % (description, SOURCE_SCHEMES)
+    parser.add_argument("--source", default=default, help=help_msg)
+
+
+def resample(t_samples, y_samples, ts=10, nb=400, t_min=None, t_max=None):
+    # mean value by ts buckets of raw samples (sorted epoch in s, series x samples), like influxdb
+    # "GROUP BY time(ts) fill(null)": return the last nb buckets of [t_min, t_max[, empty ones are nan
+    y_samples = np.atleast_2d(y_samples)
+    if t_max is not None:
+        n = np.searchsorted(t_samples, t_max)
+        t_samples, y_samples = t_samples[:n], y_samples[:, :n]
+    if not len(t_samples):
+        return np.empty(0, dtype=np.int64), np.empty((y_samples.shape[0], 0))
+    t_last = (int(t_samples[-1]) // ts) * ts
+    t_first = t_last - (nb - 1) * ts if nb else (int(t_samples[0]) // ts) * ts
+    if t_min is not None:
+        t_first = max(t_first, int(t_min) // ts * ts)
+    if t_first > t_last:
+        return np.empty(0, dtype=np.int64), np.empty((y_samples.shape[0], 0))
+    # only read the needed range (memory-mapped arrays are not loaded)
+    i0 = np.searchsorted(t_samples, t_first if t_min is None else max(t_first, t_min))
+    t_samples, y_samples = t_samples[i0:], y_samples[:, i0:]
+    n_bucket = (t_last - t_first) // ts + 1
+    idx = ((t_samples - t_first) // ts).astype(np.int64)
+    # sum and count by bucket of every series at once (nan values are ignored)
+    is_ok = ~np.isnan(y_samples)
+    flat_idx = (idx + n_bucket * np.arange(y_samples.shape[0])[:, None])[is_ok]
+    sums = np.bincount(flat_idx, weights=y_samples[is_ok], minlength=n_bucket * y_samples.shape[0])
+    counts = np.bincount(flat_idx, minlength=n_bucket * y_samples.shape[0])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        y_mean = (sums / counts).reshape(y_samples.shape[0], n_bucket)
+    return t_first + ts * np.arange(n_bucket, dtype=np.int64), y_mean
+
+
+def open_source(url):
+    # build a data source from an url:
+    #   influx://host:port/db (default: influx://localhost:8086/mydb)
+    #   npy:DIR, csv:DIR, sqlite:FILE, mem:
+    scheme, _, path = url.partition(":")
+    if scheme == "influx":
+        host_port, _, db = path.lstrip("/").partition("/")
+        host, _, port = host_port.partition(":")
+        return InfluxSource(host=host or "localhost", port=int(port or 8086), db=db or "mydb")
+    elif scheme == "npy":
+        return NpySource(path)
+    elif scheme == "csv":
+        return CsvSource(path)
+    elif scheme == "sqlite":
+        return SqliteSource(path)
+    elif scheme == "mem":
+        return MemorySource()
+    raise ValueError("unknown data source \"%s\"" % url)
+
+
+# some class
+class DataSource:
+    # base class of data sources: analyzers only use fetch(), measurements() and fields()
+    # fetch return timestamps (epoch in s) and values (series x samples) of the last nb buckets in
+    # chronological order, every bucket is the mean value of ts seconds (nan if no data)
+    def fetch(self, measurement, fields, ts=10, nb=400, t_min=None, t_max=None):
+        raise NotImplementedError
+
+    def measurements(self):
+        raise NotImplementedError
+
+    def fields(self, measurement):
+        raise NotImplementedError
+
+
+class InfluxSource(DataSource):
+    def __init__(self, host="localhost", port=8086, db="mydb"):
+        from influxdb import InfluxDBClient
+        self.client = InfluxDBClient(host=host, port=port)
+        self.client.switch_database(db)
+
+    def fetch(self, measurement, fields, ts=10, nb=400, t_min=None, t_max=None):
+        return fetch_fields(self.client, measurement, fields, ts=ts, nb=nb, t_min=t_min, t_max=t_max)
+
+    def measurements(self):
+        return [p["name"] for p in self.client.query("SHOW MEASUREMENTS").get_points()]
+
+    def fields(self, measurement):
+        req = "SHOW FIELD KEYS FROM \"%s\"" % measurement
+        return [p["fieldKey"] for p in self.client.query(req).get_points()]
+
+
+class MemorySource(DataSource):
+    # raw samples in memory: {measurement: {field: (timestamps, values)}}
+    def __init__(self):
+        self.data = {}
+
+    def write(self, measurement, field, t_samples, y_samples):
+        self.data.setdefault(measurement, {})[field] = (np.asarray(t_samples), np.asarray(y_samples, dtype=float))
+
+    def _read(self, measurement, field):
+        return self.data.get(measurement, {}).get(field)
+
+    def fetch(self, measurement, fields, ts=10, nb=400, t_min=None, t_max=None):
+        l_series = [self._read(measurement, f) for f in fields]
+        # last sample (before t_max) of every field
+        l_last = []
+        for series in l_series:
+            if series is not None:
+                n = len(series[0]) if t_max is None else np.searchsorted(series[0], t_max)
+                if n:
+                    l_last.append(int(series[0][n - 1]))
+        if not l_last:
+            return np.empty(0, dtype=np.int64), np.empty((len(fields), 0))
+        # common buckets grid ending at the last bucket of all fields
+        t_last = max(l_last) // ts * ts
+        if nb:
+            t_first = t_last - (nb - 1) * ts
+        else:
+            t_first = min(int(s[0][0]) for s in l_series if s is not None and len(s[0])) // ts * ts
+        if t_min is not None:
+            t_first = max(t_first, int(t_min) // ts * ts)
+        t_grid = np.arange(t_first, t_last + ts, ts, dtype=np.int64)
+        y_grid = np.full((len(fields), len(t_grid)), np.nan)
+        # every field is resampled on its own time base, then placed on the grid
+        for i, series in enumerate(l_series):
+            if series is not None:
+                t, y = resample(series[0], series[1], ts=ts, nb=None, t_min=max(t_first, t_min or t_first),
+                                t_max=t_last + ts)
+                y_grid[i, (t - t_first) // ts] = y[0]
+        return t_grid, y_grid
+
+    def measurements(self):
+        return sorted(self.data)
+
+    def fields(self, measurement):
+        return sorted(self.data.get(measurement, {}))
+
+
+class NpySource(MemorySource):
+    # raw samples stored as DIR/<measurement>/<field>.t.npy and <field>.y.npy, read memory-mapped
+    # (zero-copy: only the fetched range is loaded from disk)
+    def __init__(self, root):
+        MemorySource.__init__(self)
+        self.root = root
+
+    def write(self, measurement, field, t_samples, y_samples):
+        os.makedirs(os.path.join(self.root, measurement), exist_ok=True)
+        np.save(os.path.join(self.root, measurement, field + ".t.npy"), np.asarray(t_samples))
+        np.save(os.path.join(self.root, measurement, field + ".y.npy"), np.asarray(y_samples, dtype=float))
+
+    def _read(self, measurement, field):
+        path = os.path.join(self.root, measurement, field)
+        if not os.path.exists(path + ".t.npy"):
+            return None
+        return np.load(path + ".t.npy", mmap_mode="r"), np.load(path + ".y.npy", mmap_mode="r")
+
+    def measurements(self):
+        return sorted(d for d in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, d)))
+
+    def fields(self, measurement):
+        return sorted(os.path.basename(p)[:-len(".t.npy")]
+                      for p in glob.glob(os.path.join(self.root, measurement, "*.t.npy")))
+
+
+class CsvSource(MemorySource):
+    # raw samples stored as DIR/<measurement>.csv with a "time,field1,field2..." header (time epoch in s)
+    # a csv file is loaded in memory at first use
+    def __init__(self, root):
+        MemorySource.__init__(self)
+        self.root = root
+
+    def _read(self, measurement, field):
+        if measurement not in self.data:
+            path = os.path.join(self.root, measurement + ".csv")
+            if not os.path.exists(path):
+                return None
+            table = np.genfromtxt(path, delimiter=",", names=True, dtype=float)
+            t_samples = table["time"].astype(np.int64)
+            self.data[measurement] = {name: (t_samples, table[name]) for name in table.dtype.names if name != "time"}
+        return MemorySource._read(self, measurement, field)
+
+    def measurements(self):
+        return sorted(os.path.basename(p)[:-len(".csv")] for p in glob.glob(os.path.join(self.root, "*.csv")))
+
+    def fields(self, measurement):
+        with open(os.path.join(self.root, measurement + ".csv")) as f:
+            return [name.strip() for name in f.readline().split(",") if name.strip() != "time"]
+
+
+class SqliteSource(DataSource):
+    # raw samples stored in a table by measurement with a "time" column (epoch in s) and a column by field
+    # bucket means are computed by sqlite, like an influxdb GROUP BY time()
+    def __init__(self, path):
+        import sqlite3
+        self.conn = sqlite3.connect(path)
+
+    def fetch(self, measurement, fields, ts=10, nb=400, t_min=None, t_max=None):
+        select = ", ".join("avg(\"%s\")" % f for f in fields)
+        where = []
+        if t_min is not None:
+            where.append("time >= %d" % t_min)
+        if t_max is not None:
+            where.append("time < %d" % t_max)
+        req = "SELECT (CAST(time AS INTEGER) / %d) * %d AS bucket, %s FROM \"%s\" %sGROUP BY bucket " \
+              "ORDER BY bucket DESC%s" % (ts, ts, select, measurement,
+                                          "WHERE %s " % " AND ".join(where) if where else "",
+                                          " LIMIT %d" % nb if nb else "")
+        rows = np.array(self.conn.execute(req).fetchall(), dtype=float).reshape(-1, len(fields) + 1)[::-1]
+        if not len(rows):
+            return np.empty(0, dtype=np.int64), np.empty((len(fields), 0))
+        # fill missing buckets with nan (like influxdb fill(null))
+        t_last = int(rows[-1, 0])
+        t_first = max(int(rows[0, 0]), t_last - (nb - 1) * ts) if nb else int(rows[0, 0])
+        t_grid = np.arange(t_first, t_last + ts, ts, dtype=np.int64)
+        y_grid = np.full((len(fields), len(t_grid)), np.nan)
+        keep = rows[:, 0] >= t_first
+        y_grid[:, ((rows[keep, 0] - t_first) // ts).astype(np.int64)] = rows[keep, 1:].T
+        return t_grid, y_grid
+
+    def measurements(self):
+        req = "SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name"
+        return [row[0] for row in self.conn.execute(req)]
+
+    def fields(self, measurement):
+        return [row[1] for row in self.conn.execute("PRAGMA table_info(\"%s\")" % measurement) if row[1] != "time"]
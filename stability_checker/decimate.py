@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+
+# some functions
+def minmax(x, y, n_px):
+    # keep min and max samples of n_px buckets (2 * n_px points in time order): a line plot at n_px width
+    # looks the same as with all samples, spikes are kept
+    n = len(y)
+    if n <= 2 * n_px:
+        return x, y
+    size = -(-n // n_px)
+    # pad last bucket with the last value, then one argmin/argmax by bucket
+    buckets = np.pad(np.asarray(y), (0, n_px * size - n), mode="edge").reshape(n_px, size)
+    base = np.arange(n_px) * size
+    idx = np.sort(np.column_stack((base + buckets.argmin(axis=1), base + buckets.argmax(axis=1))), axis=1).ravel()
+    idx = np.unique(np.minimum(idx, n - 1))
+    return x[idx], y[idx]
+
+
+def lttb(x, y, n_out):
+    # largest triangle three buckets downsampling to n_out points (first and last points are kept):
+    # in every bucket keep the point with the largest triangle area with the previous kept point and
+    # the mean of the next bucket (visual shape is kept better than min/max for smooth signals)
+    n = len(y)
+    if n <= n_out or n_out < 3:
+        return x, y
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    # n_out - 2 buckets of the inner points
+    edges = (1 + np.arange(n_out - 1) * (n - 2) / (n_out - 2)).astype(np.int64)
+    edges[-1] = n - 1
+    counts = np.diff(edges)
+    avg_x = np.add.reduceat(x[:n - 1], edges[:-1]) / counts
+    avg_y = np.add.reduceat(y[:n - 1], edges[:-1]) / counts
+    next_x, next_y = np.r_[avg_x[1:], x[-1]], np.r_[avg_y[1:], y[-1]]
+    idx = np.empty(n_out, dtype=np.int64)
+    idx[0], idx[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        area = np.abs((x[a] - next_x[i]) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (next_y[i] - y[a]))
+        a = lo + int(np.argmax(area))
+        idx[i + 1] = a
+    return x[idx], y[idx]
@@ -1,58 +1,147 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+from stage_timer import StageTimer
+import argparse
 import sys
+import time
+import traceback
 import numpy as np
-from scipy import fftpack
-from influxdb import InfluxDBClient
+from datasource import add_source_argument, open_source
+from spectrum import SlidingDFT, acf_oscillation, auto_spectra, band_peaks, find_peaks, format_acf, format_peak, \
+    plan_window, refine_peaks
 
 
-# connect to influxdb DB
-client = InfluxDBClient(host="localhost", port=8086)
-client.switch_database("mydb")
+# some functions
+def print_peaks(fields, l_peaks, prefix=False):
+    # print peaks (freq, level) of every field, prefix lines with field name if required
+    for field, peaks in zip(fields, l_peaks):
+        for f, m in peaks:
+            print("%s%s" % (field + ": " if prefix else "", format_peak(f, m)))
 
-# request for select last 3 records of "field1" in "test" measurement (mean value by 10s steps)
-req = "SELECT mean(\"field1\") AS f1 FROM \"test\" GROUP BY time(10s) fill(null) ORDER BY time DESC LIMIT 400"
 
-# format data and check all data is available
-l_points = []
-for point in client.query(req).get_points():
-    if point['f1'] is None:
-        print("data unavailable, skip fft", file=sys.stderr)
-        exit(1)
-    l_points.append(point['f1'])
+def stream(source, args, t_samples, y_samples):
+    # rolling window with sliding DFT: every new complete bucket update the spectrum in O(bins)
+    sdft = SlidingDFT(y_samples, args.ts)
+    t_next = t_samples[-1] + args.ts
+    while True:
+        # wait for the next complete bucket
+        t_end = int(time.time()) // args.ts * args.ts
+        if t_end <= t_next:
+            time.sleep(t_next + args.ts - time.time() + 0.5)
+            continue
+        # fetch only new buckets
+        try:
+            t_new, y_new = source.fetch(args.measurement, args.fields, ts=args.ts, nb=None,
+                                        t_min=t_next, t_max=t_end)
+        except Exception:
+            traceback.print_exc(file=sys.stderr)
+            time.sleep(args.ts)
+            continue
+        # every bucket up to t_end (missing ones hold the last value)
+        is_held = sdft.update_buckets(t_new, y_new, t_next, t_end)
+        for i in np.flatnonzero(is_held):
+            print("%s: data unavailable, hold last value" % time.ctime(t_next + i * args.ts), file=sys.stderr)
+        t_next = t_end
+        # print current peaks
+        xf, ya = sdft.spectrum()
+        print("# %s" % time.ctime(t_next))
+        l_peaks = find_peaks(xf, ya, level=args.level)
+        if args.band:
+            l_peaks = band_peaks(l_peaks, *args.band)
+        print_peaks(args.fields, l_peaks, prefix=len(args.fields) > 1)
+        sys.stdout.flush()
 
-# number of samples
-Ns = len(l_points)
 
-# second between 2 samples
-Ts = 10  # 10 s
+# main program
+if __name__ == "__main__":
+    timer = StageTimer()
+    timer.mark("import")
+    # parse command line
+    parser = argparse.ArgumentParser(description="print spectral peaks of measurement fields")
+    parser.add_argument("fields", nargs="*", default=["field1"], help="fields to analyze (default: field1)")
+    parser.add_argument("-m", "--measurement", default="test", help="measurement (default: test)")
+    add_source_argument(parser)
+    parser.add_argument("-t", "--ts", type=int, default=10, help="second between 2 samples (default: 10)")
+    parser.add_argument("-n", "--samples", type=int, default=400, help="number of samples (default: 400)")
+    parser.add_argument("-b", "--band", type=float, nargs=2, metavar=("FMIN", "FMAX"),
+                        help="frequency band of interest in Hz: step and samples are chosen from it "
+                             "(override -t and -n), only peaks in band are reported")
+    parser.add_argument("-l", "--level", type=float, default=3.0, help="peak level threshold in %% (default: 3.0)")
+    parser.add_argument("-w", "--welch", type=int, metavar="NPERSEG",
+                        help="welch averaging of hann windowed segments of NPERSEG samples (for long windows)")
+    parser.add_argument("-r", "--refine", action="store_true",
+                        help="sub-bin frequency and level of peaks (zoom fft around every peak)")
+    parser.add_argument("-a", "--acf", action="store_true",
+                        help="also detect oscillations from autocorrelation (period and regularity index)")
+    parser.add_argument("--cache", metavar="DIR", help="local cache of fetched series (query only new points)")
+    parser.add_argument("--cache-size", type=int, default=256, metavar="MB", help="cache size limit (default: 256 MB)")
+    parser.add_argument("-s", "--stream", action="store_true",
+                        help="keep a rolling window and report on every new sample")
+    parser.add_argument("--profile", action="store_true", help="report import and stage timings to stderr")
+    args = parser.parse_args()
+    timer.enabled = args.profile
+    timer.mark("args")
+    # band driven downsampling: the historian return only the needed buckets
+    if args.band:
+        try:
+            args.ts, args.samples = plan_window(*args.band)
+        except ValueError as e:
+            parser.error(str(e))
+        print("band %g-%g Hz: step = %d s, samples = %d" % (args.band[0], args.band[1], args.ts, args.samples),
+              file=sys.stderr)
+    # prefix messages with field name when several fields are analyzed
+    multi = len(args.fields) > 1
 
-# N samples, every sample is time value (in s)
-# 0 -> t_max with Ns items
-t_max = Ts * Ns
-t_samples = np.linspace(0.0, t_max, Ns)
+    # connect to data source
+    source = open_source(args.source)
+    timer.mark("connect")
 
-# convert list to numpy array
-y_samples = np.asarray(l_points)
+    # fetch all series (only complete buckets in stream mode)
+    if args.cache and not args.stream:
+        from ts_cache import SeriesCache, fetch_cached
+        cache = SeriesCache(args.cache, max_bytes=args.cache_size << 20)
+        t_samples, y_samples = fetch_cached(source, cache, args.measurement, args.fields, ts=args.ts, nb=args.samples)
+    else:
+        t_max = int(time.time()) // args.ts * args.ts if args.stream else None
+        t_samples, y_samples = source.fetch(args.measurement, args.fields, ts=args.ts, nb=args.samples, t_max=t_max)
+    timer.mark("fetch")
 
-# build signal
-nb = len(y_samples)
-x = np.linspace(0.0, (nb - 1) * Ts, nb)
+    # spectrum of every series: Lomb-Scargle is used for series with missing samples
+    l_spectra = auto_spectra(t_samples, y_samples, args.ts, nperseg=args.welch)
+    is_full = ~np.isnan(y_samples).any(axis=1) & (y_samples.shape[1] > 0)
+    for i, (field, spectrum, full) in enumerate(zip(args.fields, l_spectra, is_full)):
+        if spectrum is None:
+            print("%sdata unavailable, skip fft" % (field + ": " if multi else ""), file=sys.stderr)
+            continue
+        if not full:
+            print("%smissing samples, use Lomb-Scargle" % (field + ": " if multi else ""), file=sys.stderr)
+        # print peak higher than level (with sub-bin refinement if required)
+        l_peaks = find_peaks(spectrum[0], spectrum[1], level=args.level)
+        if args.refine and full and not args.welch:
+            l_peaks = refine_peaks(y_samples[i], args.ts, l_peaks)
+        if args.band:
+            l_peaks = band_peaks(l_peaks, *args.band)
+        print_peaks([field], l_peaks, prefix=multi)
+    is_ok = np.array([spectrum is not None for spectrum in l_spectra])
+    timer.mark("spectrum")
 
-# compute fft
-yf = fftpack.fft(y_samples)
-xf = np.linspace(0.0, 1.0 / (2.0 * Ts), nb // 2)
-ya = 2.0 / nb * np.abs(yf[:nb // 2])
+    # autocorrelation detector of every series at once (more robust to noise than spectral levels)
+    if args.acf and is_ok.any():
+        # unavailable series are left out (an all nan row has no autocorrelation)
+        l_fields = [field for field, ok in zip(args.fields, is_ok) if ok]
+        periods, regularities, is_osc = acf_oscillation(y_samples[is_ok], args.ts)
+        for field, period, regularity, osc in zip(l_fields, periods, regularities, is_osc):
+            print("%sacf: %s" % (field + ": " if multi else "", format_acf(period, regularity, osc)))
+        timer.mark("acf")
+    timer.report()
 
-# normalize ya to % of signal
-ya = ya * 100.0 / ya.sum()
+    # streaming mode: all series must be complete at startup
+    if args.stream and is_full.all():
+        try:
+            stream(source, args, t_samples, y_samples)
+        except KeyboardInterrupt:
+            pass
 
-# print peak higher than 3%
-for i in np.argwhere(ya > 3.0).flatten():
-    f = xf[i]
-    m = ya[i]
-    if f > 0:
-        print("freq = %.4f Hz, level = %.2f %%,  period = %.2f s" % (f, m, 1/f))
-    else:
-        print("freq = %.4f Hz, level = %.2f %%" % (f, m))
+    # exit with error if some data are unavailable
+    exit(0 if is_ok.all() else 1)
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from datasource import add_source_argument
+from spectrum import auto_spectra, band_peaks, find_peaks, format_peak, plan_window
+from worker import Worker, expand_targets, init_worker, worker_fetch
+
+
+# some functions
+def scan(measurement, fields, ts=10, nb=400, level=3.0, band=None):
+    # fetch all fields of a measurement in one query, then analyze them in one pass
+    t0 = time.perf_counter()
+    t_samples, y_samples = worker_fetch(measurement, fields, ts=ts, nb=nb)
+    t1 = time.perf_counter()
+    # series with missing samples use the Lomb-Scargle path
+    l_peaks = [None if spectrum is None else find_peaks(spectrum[0], spectrum[1], level=level)[0]
+               for spectrum in auto_spectra(t_samples, y_samples, ts)]
+    # only peaks in band of interest
+    if band:
+        l_peaks = [None if peaks is None else band_peaks([peaks], *band)[0] for peaks in l_peaks]
+    l_peaks = [None if peaks is None else peaks.tolist() for peaks in l_peaks]
+    t2 = time.perf_counter()
+    return measurement, fields, l_peaks, t1 - t0, t2 - t1
+
+
+# main program
+if __name__ == "__main__":
+    # parse command line
+    parser = argparse.ArgumentParser(description="scan spectral peaks of many measurement fields in parallel")
+    parser.add_argument("targets", nargs="+", help="measurement:field to scan, glob allowed (ex: \"loop_*:pv\")")
+    add_source_argument(parser)
+    parser.add_argument("-t", "--ts", type=int, default=10, help="second between 2 samples (default: 10)")
+    parser.add_argument("-n", "--samples", type=int, default=400, help="number of samples (default: 400)")
+    parser.add_argument("--band", type=float, nargs=2, metavar=("FMIN", "FMAX"),
+                        help="frequency band of interest in Hz: step and samples are chosen from it "
+                             "(override -t and -n), only peaks in band are reported")
+    parser.add_argument("-l", "--level", type=float, default=3.0, help="peak level threshold in %% (default: 3.0)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("-b", "--batch", type=int, default=64, help="max fields by worker task (default: 64)")
+    parser.add_argument("--cache", metavar="DIR", help="local cache of fetched series (query only new points)")
+    parser.add_argument("--cache-size", type=int, default=256, metavar="MB", help="cache size limit (default: 256 MB)")
+    args = parser.parse_args()
+    if args.band:
+        try:
+            args.ts, args.samples = plan_window(*args.band)
+        except ValueError as e:
+            parser.error(str(e))
+
+    t_start = time.perf_counter()
+    # build the task list: fields of a measurement are fetched together (up to batch fields by task)
+    init_worker(args.source, args.cache, args.cache_size)
+    d_targets = expand_targets(Worker.source, args.targets)
+    l_tasks = [(m, fields[i:i + args.batch]) for m, fields in sorted(d_targets.items())
+               for i in range(0, len(fields), args.batch)]
+    if not l_tasks:
+        print("no field match targets", file=sys.stderr)
+        exit(1)
+
+    # fan out fetch and fft over the process pool
+    l_fetch_t, l_fft_t = [], []
+    n_loops = n_skip = 0
+    with ProcessPoolExecutor(max_workers=args.jobs, initializer=init_worker,
+                             initargs=(args.source, args.cache)) as executor:
+        d_futures = {executor.submit(scan, m, fields, ts=args.ts, nb=args.samples, level=args.level,
+                                     band=args.band): (m, fields) for m, fields in l_tasks}
+        for future in as_completed(d_futures):
+            try:
+                measurement, fields, l_peaks, fetch_t, fft_t = future.result()
+            except Exception as e:
+                # a failed task (query or I/O error...) skip its fields only
+                measurement, fields = d_futures[future]
+                n_loops += len(fields)
+                n_skip += len(fields)
+                for field in fields:
+                    print("%s:%s: %s: %s, skip fft" % (measurement, field, type(e).__name__, e), file=sys.stderr)
+                continue
+            l_fetch_t.append(fetch_t)
+            l_fft_t.append(fft_t)
+            # print per-loop results
+            for field, peaks in zip(fields, l_peaks):
+                n_loops += 1
+                if peaks is None:
+                    n_skip += 1
+                    print("%s:%s: data unavailable, skip fft" % (measurement, field), file=sys.stderr)
+                    continue
+                for f, m in peaks:
+                    print("%s:%s: %s" % (measurement, field, format_peak(f, m)))
+    # cache size limit is enforced once all workers are done
+    if Worker.cache:
+        Worker.cache.evict()
+    wall_t = time.perf_counter() - t_start
+
+    # wall-time statistics
+    print("# %d loops (%d skipped) in %d tasks, %d jobs, wall time = %.3f s, %.1f loops/s" %
+          (n_loops, n_skip, len(l_tasks), args.jobs, wall_t, n_loops / wall_t), file=sys.stderr)
+    for name, l_t in (("fetch", l_fetch_t), ("fft", l_fft_t)):
+        if l_t:
+            print("# %-5s by task: mean = %.4f s, max = %.4f s, total = %.3f s" %
+                  (name, np.mean(l_t), np.max(l_t), np.sum(l_t)), file=sys.stderr)
+
+    # exit with error if some data are unavailable
+    exit(1 if n_skip else 0)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+
+# some functions
+def build_query(measurement, fields, ts=10, nb=400, t_min=None, t_max=None):
+    # request for select last nb records of every field in measurement (mean value by ts steps)
+    # all fields are fetch in one round trip, optional time range bounds are epoch in s
+    select = ", ".join("mean(\"%s\") AS \"%s\"" % (f, f) for f in fields)
+    where = []
+    if t_min is not None:
+        where.append("time >= %ds" % t_min)
+    if t_max is not None:
+        where.append("time < %ds" % t_max)
+    return "SELECT %s FROM \"%s\" %sGROUP BY time(%ds) fill(null) ORDER BY time DESC%s" % \
+           (select, measurement, "WHERE %s " % " AND ".join(where) if where else "", ts,
+            " LIMIT %d" % nb if nb else "")
+
+
+def chunks_to_arrays(raw_chunks, fields, size_hint=None, descending=False):
+    # decode raw influxdb responses chunks ({"series": [{"columns": [...], "values": [...]}]})
+    # straight into preallocated timestamps and values (series x samples) arrays
+    # null values are set to nan, result is always in chronological order
+    size = size_hint or 1024
+    t_samples = np.empty(size, dtype=np.int64)
+    y_samples = np.empty((len(fields), size))
+    n = 0
+    for raw in raw_chunks:
+        for series in raw.get("series", []):
+            values = np.array(series["values"], dtype=float)
+            if not len(values):
+                continue
+            cols = [series["columns"].index(c) for c in ["time"] + list(fields)]
+            k = len(values)
+            # grow buffers (doubling) if size_hint is exceeded
+            if n + k > size:
+                size = max(2 * size, n + k)
+                t_samples = _resize(t_samples, size, n, descending)
+                y_samples = _resize(y_samples, size, n, descending)
+            # descending data are stored from buffer end, so no reverse copy is needed
+            if descending:
+                sl = slice(size - n - k, size - n)
+                t_samples[sl] = values[::-1, cols[0]]
+                y_samples[:, sl] = values[::-1, cols[1:]].T
+            else:
+                t_samples[n:n + k] = values[:, cols[0]]
+                y_samples[:, n:n + k] = values[:, cols[1:]].T
+            n += k
+    if descending:
+        return t_samples[size - n:], y_samples[:, size - n:]
+    return t_samples[:n], y_samples[:, :n]
+
+
+def _resize(buf, size, n, descending):
+    # copy the n used items of buf to a new buffer of size items (keep the used side)
+    new_buf = np.empty(buf.shape[:-1] + (size,), dtype=buf.dtype)
+    if descending:
+        new_buf[..., size - n:] = buf[..., buf.shape[-1] - n:]
+    else:
+        new_buf[..., :n] = buf[..., :n]
+    return new_buf
+
+
+def query_arrays(client, req, fields, size_hint=None, descending=False, chunk_size=10000):
+    # stream a chunked query response into numpy arrays (no per-row dict or list)
+    l_rs = client.query(req, epoch="s", chunked=True, chunk_size=chunk_size)
+    return chunks_to_arrays((rs.raw for rs in l_rs), fields, size_hint=size_hint, descending=descending)
+
+
+def fetch_fields(client, measurement, fields, ts=10, nb=400, t_min=None, t_max=None, chunk_size=10000):
+    # fetch last nb buckets of fields as timestamps (epoch in s) and values (series x samples)
+    req = build_query(measurement, fields, ts=ts, nb=nb, t_min=t_min, t_max=t_max)
+    return query_arrays(client, req, fields, size_hint=nb, descending=True, chunk_size=chunk_size)
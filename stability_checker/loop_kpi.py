@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import fnmatch
+import sys
+import time
+import numpy as np
+from datasource import add_source_argument, open_source
+
+
+# some const
+KPIS = ("iae", "ise", "itae", "steps", "overshoot", "settling", "saturation", "osc_index")
+
+
+# some functions
+def hold_last(y):
+    # replace nan samples (rows x samples) by the last valid one of their row (leading nan are kept)
+    pos = np.where(np.isnan(y), 0, np.arange(y.shape[1]))
+    np.maximum.accumulate(pos, axis=1, out=pos)
+    return y[np.arange(y.shape[0])[:, None], pos]
+
+
+def split_windows(y, window=None):
+    # (rows x samples) -> (rows x windows x window), windows end at the last sample (oldest samples
+    # that don't fill a window are dropped), one window of all samples if window is None
+    y = np.atleast_2d(y)
+    if not window:
+        return y[:, None, :]
+    n_win = y.shape[1] // window
+    return y[:, y.shape[1] - n_win * window:].reshape(y.shape[0], n_win, window)
+
+
+def segments(start):
+    # flat layout of segments from a (rows x samples) start mask, the first sample of every row is a start
+    # return the flat index of first sample and the row of every segment, the segment of every sample
+    start = start.copy()
+    start[:, 0] = True
+    flat = start.ravel()
+    starts = np.flatnonzero(flat)
+    return starts, starts // start.shape[1], np.cumsum(flat) - 1
+
+
+def fetch_loops(source, patterns, fields, ts=10, nb=400):
+    # fetch fields of loop measurements (glob allowed) on a common window of nb buckets
+    # return loop names, timestamps and values (fields x loops x samples), loops with a shorter history
+    # are nan padded, loops without data are skipped
+    measurements = []
+    for pattern in patterns:
+        if any(c in pattern for c in "*?["):
+            measurements.extend(m for m in fnmatch.filter(source.measurements(), pattern) if m not in measurements)
+        elif pattern not in measurements:
+            measurements.append(pattern)
+    l_loops, l_series = [], []
+    for measurement in measurements:
+        t_samples, y_samples = source.fetch(measurement, fields, ts=ts, nb=nb)
+        if not len(t_samples):
+            print("%s: data unavailable, skip" % measurement, file=sys.stderr)
+            continue
+        l_loops.append(measurement)
+        l_series.append((t_samples, y_samples))
+    if not l_loops:
+        return [], np.empty(0, dtype=np.int64), np.empty((len(fields), 0, nb))
+    t_end = max(t[-1] for t, _ in l_series)
+    t_grid = t_end - ts * np.arange(nb - 1, -1, -1, dtype=np.int64)
+    y_all = np.full((len(fields), len(l_loops), nb), np.nan)
+    for i, (t_samples, y_samples) in enumerate(l_series):
+        keep = t_samples >= t_grid[0]
+        y_all[:, i, (t_samples[keep] - t_grid[0]) // ts] = y_samples[:, keep]
+    return l_loops, t_grid, y_all
+
+
+def loop_kpis(pv, sp, out, ts=1, window=None, sp_tol=1e-6, settle_band=0.02, out_range=(0.0, 100.0),
+              sat_tol=0.5, pv_range=100.0, tu=None):
+    # control loop performance indicators of PV, SP and OUT series (loops x samples on a common ts grid)
+    # computed in one pass for every loops and windows (of window samples) at once
+    # return a {kpi: array (loops x windows)} dict:
+    #   iae, ise, itae: integrated absolute/square/time-weighted absolute error (time since last SP change)
+    #   steps: number of SP changes, overshoot: max overshoot of SP steps (in % of step size)
+    #   settling: mean time to stay in settle_band of step size (in s, nan if no settled step)
+    #   saturation: ratio of time with OUT at a limit of out_range (within sat_tol)
+    #   osc_index: Hägglund load disturbances (half-cycles of error with IAE > 2a/wu, a = 1 % of pv_range)
+    #   by supervision time (50 tu, or the window if shorter), over 10 the loop oscillates, tu is estimated
+    #   from error zero crossings if not set
+    # missing samples hold the last value
+    pv, sp, out = (split_windows(hold_last(np.atleast_2d(np.asarray(y, dtype=float))), window)
+                   for y in (pv, sp, out))
+    n_loops, n_win, n_s = pv.shape
+    # setpoint changes, a window starts on a change if its SP differs from the last one of the previous window
+    sp_step = np.zeros(sp.shape, dtype=bool)
+    sp_step[..., 1:] = np.abs(np.diff(sp, axis=-1)) > sp_tol
+    sp_step[:, 1:, 0] = np.abs(sp[:, 1:, 0] - sp[:, :-1, -1]) > sp_tol
+    pv, sp, out, sp_step = (y.reshape(n_loops * n_win, n_s) for y in (pv, sp, out, sp_step))
+    n_rows = pv.shape[0]
+    err = sp - pv
+    is_ok = ~np.isnan(err)
+    abs_err = np.where(is_ok, np.abs(err), 0.0)
+    d_kpis = {}
+
+    # segments between setpoint changes
+    starts, seg_row, seg_id = segments(sp_step)
+    pos = np.arange(n_rows * n_s)
+    t_rel = (pos - starts[seg_id]) * ts
+    d_kpis["iae"] = abs_err.sum(axis=1) * ts
+    d_kpis["ise"] = (abs_err ** 2).sum(axis=1) * ts
+    d_kpis["itae"] = (t_rel.reshape(n_rows, n_s) * abs_err).sum(axis=1) * ts
+
+    # step responses: every segment starting on a SP change
+    flat_pv, flat_sp = pv.ravel(), sp.ravel()
+    is_step = sp_step.ravel()[starts]
+    d_sp = np.full(len(starts), np.nan)
+    d_sp[is_step] = flat_sp[starts[is_step]] - flat_sp[starts[is_step] - 1]
+    # overshoot: max error beyond SP in the step direction
+    over = (flat_pv - flat_sp) * np.sign(d_sp)[seg_id]
+    seg_over = np.fmax(np.fmax.reduceat(over, starts), 0.0) / np.abs(d_sp) * 100
+    # settling: last sample out of the band, unsettled if the segment ends out of the band
+    is_out = np.abs(flat_pv - flat_sp) > settle_band * np.abs(d_sp)[seg_id]
+    last_out = np.maximum.reduceat(np.where(is_out, pos, -1), starts)
+    ends = np.r_[starts[1:], n_rows * n_s] - 1
+    seg_settle = np.where(last_out < 0, 0.0, (last_out - starts + 1) * ts).astype(float)
+    seg_settle[(last_out == ends) | ~is_step] = np.nan
+    # by row: step count, max overshoot, mean settling time of settled steps
+    d_kpis["steps"] = np.bincount(seg_row[is_step], minlength=n_rows)
+    row_starts = np.searchsorted(seg_row, np.arange(n_rows))
+    d_kpis["overshoot"] = np.fmax.reduceat(seg_over, row_starts)
+    is_settled = ~np.isnan(seg_settle)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        d_kpis["settling"] = (np.bincount(seg_row[is_settled], weights=seg_settle[is_settled], minlength=n_rows) /
+                              np.bincount(seg_row[is_settled], minlength=n_rows))
+
+    # output saturation ratio
+    out_ok = ~np.isnan(out)
+    is_sat = (out <= out_range[0] + sat_tol) | (out >= out_range[1] - sat_tol)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        d_kpis["saturation"] = (is_sat & out_ok).sum(axis=1) / out_ok.sum(axis=1)
+
+    # Hägglund oscillation detection: IAE of every half-cycle between error zero crossings
+    sign = err >= 0
+    cross = np.zeros(err.shape, dtype=bool)
+    cross[:, 1:] = sign[:, 1:] != sign[:, :-1]
+    starts, seg_row, _ = segments(cross)
+    hc_iae = np.add.reduceat(abs_err.ravel(), starts) * ts
+    n_hc = np.bincount(seg_row, minlength=n_rows)
+    duration = is_ok.sum(axis=1) * ts
+    if tu is None:
+        # ultimate period ~ 2 mean half-cycle durations
+        with np.errstate(divide="ignore"):
+            tu = 2 * duration / n_hc
+    iae_lim = 2 * (0.01 * pv_range) / (2 * np.pi / np.asarray(tu, dtype=float))
+    n_load = np.bincount(seg_row[hc_iae > np.broadcast_to(iae_lim, (n_rows,))[seg_row]], minlength=n_rows)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        d_kpis["osc_index"] = n_load * np.minimum(1.0, 50 * tu / duration)
+
+    return {kpi: np.asarray(v).reshape(n_loops, n_win) for kpi, v in d_kpis.items()}
+
+
+# main program
+if __name__ == "__main__":
+    # parse command line
+    parser = argparse.ArgumentParser(description="compute control loop performance indicators of many loops")
+    parser.add_argument("measurements", nargs="+", help="loop measurements, glob allowed (ex: \"loop_*\")")
+    add_source_argument(parser)
+    parser.add_argument("--fields", nargs=3, default=["pv", "sp", "out"], metavar=("PV", "SP", "OUT"),
+                        help="process value, setpoint and output fields (default: pv sp out)")
+    parser.add_argument("-t", "--ts", type=int, default=10, help="second between 2 samples (default: 10)")
+    parser.add_argument("-n", "--samples", type=int, default=60480, help="number of samples (default: 60480, 1 week)")
+    parser.add_argument("-w", "--window", type=int, default=8640,
+                        help="samples by KPI window, 0 for one window (default: 8640, 1 day)")
+    parser.add_argument("--out-range", type=float, nargs=2, default=[0.0, 100.0], metavar=("MIN", "MAX"),
+                        help="output limits for saturation (default: 0 100)")
+    parser.add_argument("--pv-range", type=float, default=100.0, help="process value span (default: 100)")
+    parser.add_argument("--tu", type=float, help="ultimate period in s for oscillation index (default: estimated)")
+    args = parser.parse_args()
+
+    # fetch all loops on a common window
+    t0 = time.perf_counter()
+    l_loops, t_grid, y_all = fetch_loops(open_source(args.source), args.measurements, args.fields, ts=args.ts,
+                                         nb=args.samples)
+    if not l_loops:
+        exit(1)
+    t1 = time.perf_counter()
+
+    # KPIs of every loops and windows at once
+    d_kpis = loop_kpis(*y_all, ts=args.ts, window=args.window, out_range=args.out_range, pv_range=args.pv_range,
+                       tu=args.tu)
+    t2 = time.perf_counter()
+
+    # print csv table: one line by loop and window
+    window = args.window or args.samples
+    t_win = t_grid[len(t_grid) - d_kpis["iae"].shape[1] * window::window]
+    print(",".join(("measurement", "window") + KPIS))
+    for i, measurement in enumerate(l_loops):
+        for j, t in enumerate(t_win):
+            print(",".join([measurement, time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(t))] +
+                           ["%.6g" % d_kpis[kpi][i, j] for kpi in KPIS]))
+    print("# %d loops, fetch = %.3f s, kpi = %.3f s" % (len(l_loops), t1 - t0, t2 - t1), file=sys.stderr)
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import sys
+import time
+import numpy as np
+from datasource import add_source_argument, open_source
+from loop_kpi import fetch_loops, hold_last
+
+
+# some const
+PARAMS = ("gain", "t1", "t2", "zeta", "dead_time", "r2")
+
+
+# some functions
+def find_steps(u, min_step, n_pre=10, n_post=200):
+    # steps of u (loops x samples) larger than min_step with n_pre samples before and n_post samples
+    # from the step without an other step, a step spread over consecutive samples counts as one
+    # return loop index and sample index of every step
+    u = np.atleast_2d(u)
+    is_step = np.zeros(u.shape, dtype=bool)
+    is_step[:, 1:] = np.abs(np.nan_to_num(np.diff(u, axis=1))) > min_step
+    is_step[:, 1:] &= ~is_step[:, :-1]
+    loop, pos = np.nonzero(is_step)
+    is_ok = (pos >= n_pre) & (pos + n_post <= u.shape[1])
+    # isolated steps only
+    same = loop[1:] == loop[:-1]
+    gap = pos[1:] - pos[:-1]
+    is_ok[:-1] &= ~same | (gap >= n_post)
+    is_ok[1:] &= ~same | (gap >= n_pre)
+    return loop[is_ok], pos[is_ok]
+
+
+def step_windows(y, loop, pos, n_pre=10, n_post=200):
+    # windows of n_pre + n_post samples around steps (steps x samples)
+    return np.atleast_2d(y)[loop[:, None], pos[:, None] + np.arange(-n_pre, n_post)]
+
+
+def _regressors(y, u, d, order, k0):
+    # ARX regressors (steps x rows x params) of rows k0 to the end, d is the dead time of every step
+    k = np.arange(k0, y.shape[1])
+    rows = np.arange(y.shape[0])[:, None]
+    return np.stack([y[:, k0 - i:y.shape[1] - i] for i in range(1, order + 1)] +
+                    [u[rows, np.maximum(k - i - d[:, None], 0)] for i in range(1, order + 1)], axis=2)
+
+
+def _solve(x, z, y_k):
+    # batched normal equations z'x theta = z'y (z = x for least squares, instruments otherwise)
+    zx = np.einsum("snp,snq->spq", z, x)
+    zy = np.einsum("snp,sn->sp", z, y_k)
+    # tiny ridge against singular equations (flat windows)
+    zx += (1e-9 * np.abs(np.trace(zx, axis1=1, axis2=2)) + 1e-300)[:, None, None] * np.eye(x.shape[2])
+    return np.linalg.solve(zx, zy[..., None])[..., 0]
+
+
+def simulate(theta, u, d, order):
+    # output of ARX models (params a1.., b1.. by step) driven by u (steps x samples) from zero initial state
+    y = np.zeros(u.shape)
+    rows = np.arange(u.shape[0])
+    for k in range(order, u.shape[1]):
+        for i in range(1, order + 1):
+            y[:, k] += theta[:, i - 1] * y[:, k - i] + theta[:, order + i - 1] * u[rows, np.maximum(k - i - d, 0)]
+    return y
+
+
+def fit_arx(u, y, ts=1, order=1, n_pre=10, dead_max=30, n_iv=2):
+    # fit FOPDT (order 1) or SOPDT (order 2) models of y response to u on step windows (steps x samples)
+    # by batched least squares of a discrete ARX model on deviations from pre-step means:
+    #   y[k] = a1 y[k-1] (+ a2 y[k-2]) + b1 u[k-1-d] (+ b2 u[k-2-d])
+    # refined by n_iv instrumental variable iterations (simulated outputs as instruments remove the noise
+    # bias of ARX), for every dead time d of 0 to dead_max samples: the best simulated response is kept
+    # return a {param: array (steps)} dict: gain, time constants t1 >= t2 (in s, t2 is 0 for FOPDT, nan
+    # for underdamped SOPDT), damping ratio zeta, dead time (in s) and r2 of the simulated response
+    # (nan params for unstable models)
+    u = np.atleast_2d(u) - np.mean(u[:, :n_pre], axis=1, keepdims=True)
+    y = np.atleast_2d(y) - np.mean(y[:, :n_pre], axis=1, keepdims=True)
+    n_steps, n_s = y.shape
+    dead_max = min(dead_max, n_s - 2 * order - 1)
+    best_mse = np.full(n_steps, np.inf)
+    theta = np.full((n_steps, 2 * order), np.nan)
+    best_d = np.zeros(n_steps, dtype=np.int64)
+    for d in range(dead_max + 1):
+        k0 = order + d
+        d_steps = np.full(n_steps, d)
+        x = _regressors(y, u, d_steps, order, k0)
+        theta_d = _solve(x, x, y[:, k0:])
+        # instrumental variable iterations: simulated outputs are noise free instruments
+        for _ in range(n_iv):
+            # intermediate models may be unstable (their instruments give non finite params, rejected below)
+            with np.errstate(over="ignore", invalid="ignore"):
+                z = _regressors(simulate(theta_d, u, d_steps, order), u, d_steps, order, k0)
+            theta_iv = _solve(x, z, y[:, k0:])
+            is_ok = np.isfinite(theta_iv).all(axis=1)
+            theta_d[is_ok] = theta_iv[is_ok]
+        # dead time with the best simulated response
+        with np.errstate(over="ignore", invalid="ignore"):
+            mse = np.mean((y - simulate(theta_d, u, d_steps, order)) ** 2, axis=1)
+        is_best = mse < best_mse
+        best_mse[is_best] = mse[is_best]
+        theta[is_best] = theta_d[is_best]
+        best_d[is_best] = d
+    a, b = theta[:, :order], theta[:, order:]
+    d_params = {"dead_time": best_d * float(ts)}
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        d_params["gain"] = b.sum(axis=1) / (1 - a.sum(axis=1))
+        d_params["r2"] = 1 - best_mse / np.var(y, axis=1)
+        if order == 1:
+            is_ok = (a[:, 0] > 0) & (a[:, 0] < 1)
+            d_params["t1"] = np.where(is_ok, -ts / np.log(np.where(is_ok, a[:, 0], 0.5)), np.nan)
+            d_params["t2"] = np.where(is_ok, 0.0, np.nan)
+            d_params["zeta"] = np.where(is_ok, np.inf, np.nan)
+        else:
+            # discrete poles (roots of z^2 - a1 z - a2) -> continuous poles s = ln(z) / ts
+            # (a real pole at or below 0 is a negligible time constant)
+            sq = np.sqrt((a[:, 0] ** 2 + 4 * a[:, 1]).astype(complex))
+            z = np.stack(((a[:, 0] + sq) / 2, (a[:, 0] - sq) / 2), axis=1)
+            is_ok = (np.abs(z) < 1).all(axis=1)
+            is_real = is_ok & (z.imag == 0).all(axis=1)
+            z = np.where((z.imag == 0) & (z.real < 1e-9), 1e-9, z)
+            s = np.log(np.where(is_ok[:, None], z, 0.5)) / ts
+            wn = np.sqrt(np.real(s[:, 0] * s[:, 1]))
+            d_params["zeta"] = np.where(is_ok, -np.real(s.sum(axis=1)) / (2 * wn), np.nan)
+            tau = np.sort(-1 / np.where(is_real[:, None], s.real, -1.0), axis=1)
+            d_params["t1"] = np.where(is_real, tau[:, 1], np.nan)
+            d_params["t2"] = np.where(is_real, tau[:, 0], np.nan)
+        for param in ("gain", "dead_time", "r2"):
+            d_params[param] = np.where(is_ok, d_params[param], np.nan)
+    return d_params
+
+
+def identify(u, y, ts=1, order=1, min_step=1.0, n_pre=10, n_post=200, dead_max=30, is_man=None):
+    # detect steps of u (loops x samples) and fit models of y responses to every steps at once
+    # is_man (loops x samples, optional) is the loop manual mode: only steps with the loop in manual mode
+    # over the whole window are kept (open loop responses)
+    # return loop index, sample index and size of steps and the {param: array (steps)} dict of fit_arx
+    u, y = hold_last(np.atleast_2d(np.asarray(u, dtype=float))), hold_last(np.atleast_2d(np.asarray(y, dtype=float)))
+    loop, pos = find_steps(u, min_step, n_pre=n_pre, n_post=n_post)
+    u_win, y_win = step_windows(u, loop, pos, n_pre, n_post), step_windows(y, loop, pos, n_pre, n_post)
+    # skip windows with missing samples
+    is_ok = ~(np.isnan(u_win).any(axis=1) | np.isnan(y_win).any(axis=1))
+    if is_man is not None:
+        man_win = step_windows(hold_last(np.atleast_2d(np.asarray(is_man, dtype=float))), loop, pos, n_pre, n_post)
+        is_ok &= (np.nan_to_num(man_win) > 0.5).all(axis=1)
+    loop, pos, u_win, y_win = loop[is_ok], pos[is_ok], u_win[is_ok], y_win[is_ok]
+    size = u_win[:, -1] - u_win[:, n_pre - 1]
+    if not len(loop):
+        return loop, pos, size, {param: np.empty(0) for param in PARAMS}
+    return loop, pos, size, fit_arx(u_win, y_win, ts=ts, order=order, n_pre=n_pre, dead_max=dead_max)
+
+
+# main program
+if __name__ == "__main__":
+    # parse command line
+    parser = argparse.ArgumentParser(description="identify FOPDT/SOPDT models of loops from steps in history")
+    parser.add_argument("measurements", nargs="+", help="loop measurements, glob allowed (ex: \"loop_*\")")
+    add_source_argument(parser)
+    parser.add_argument("--fields", nargs=3, default=["pv", "sp", "out"], metavar=("PV", "SP", "OUT"),
+                        help="process value, setpoint and output fields (default: pv sp out)")
+    parser.add_argument("-i", "--input", choices=("out", "sp"), default="out",
+                        help="step input: out for process model (manual output steps), sp for closed-loop "
+                             "model (setpoint steps) (default: out)")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--man", metavar="FIELD", help="manual mode field (1 in manual): with -i out, only steps "
+                                                     "in manual mode are kept")
+    mode.add_argument("--auto", metavar="FIELD", help="auto mode field (0 in manual): with -i out, only steps "
+                                                      "in manual mode are kept")
+    parser.add_argument("-o", "--order", type=int, choices=(1, 2), default=1,
+                        help="model order: 1 for FOPDT, 2 for SOPDT (default: 1)")
+    parser.add_argument("-t", "--ts", type=int, default=1, help="second between 2 samples (default: 1)")
+    parser.add_argument("-n", "--samples", type=int, default=86400, help="number of samples (default: 86400)")
+    parser.add_argument("--min-step", type=float, default=1.0, help="min step size of input (default: 1.0)")
+    parser.add_argument("--pre", type=int, default=10, help="samples before step (default: 10)")
+    parser.add_argument("--post", type=int, default=300, help="samples from step (default: 300)")
+    parser.add_argument("--dead-max", type=int, default=30, help="max dead time in samples (default: 30)")
+    args = parser.parse_args()
+
+    # fetch all loops on a common window (with the mode field for output steps)
+    mode_field = (args.man or args.auto) if args.input == "out" else None
+    t0 = time.perf_counter()
+    l_loops, t_grid, y_all = fetch_loops(open_source(args.source), args.measurements,
+                                         args.fields + ([mode_field] if mode_field else []), ts=args.ts,
+                                         nb=args.samples)
+    if not l_loops:
+        exit(1)
+    t1 = time.perf_counter()
+
+    # fit all steps of all loops at once
+    y_pv, y_u = y_all[0], y_all[2 if args.input == "out" else 1]
+    is_man = None
+    if mode_field:
+        is_man = y_all[3] if args.man else np.where(np.isnan(y_all[3]), np.nan, y_all[3] < 0.5)
+    loop, pos, size, d_params = identify(y_u, y_pv, ts=args.ts, order=args.order, min_step=args.min_step,
+                                         n_pre=args.pre, n_post=args.post, dead_max=args.dead_max, is_man=is_man)
+    t2 = time.perf_counter()
+
+    # print csv table: one line by step
+    print(",".join(("measurement", "time", "step") + PARAMS))
+    for i in range(len(loop)):
+        print(",".join([l_loops[loop[i]], time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(t_grid[pos[i]])),
+                        "%.6g" % size[i]] + ["%.6g" % d_params[param][i] for param in PARAMS]))
+    print("# %d loops, %d steps, fetch = %.3f s, fit = %.3f s" % (len(l_loops), len(loop), t1 - t0, t2 - t1),
+          file=sys.stderr)
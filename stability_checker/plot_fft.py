@@ -1,62 +1,139 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+from stage_timer import StageTimer
+import argparse
+import os
 import sys
 import numpy as np
-import matplotlib.pyplot as plt
-from scipy import fftpack
-from influxdb import InfluxDBClient
+from datasource import add_source_argument
+from decimate import lttb, minmax
+from spectrum import fft_spectrum
+from worker import Worker, expand_targets, init_worker, worker_fetch
 
 
-# connect to influxdb DB
-client = InfluxDBClient(host="localhost", port=8086)
-client.switch_database("mydb")
+# some functions
+def load(measurement, field, ts=10, nb=400):
+    # fetch a series with the worker source (and cache), return time (s from window start), values
+    # and spectrum (in % of signal), None if some data are unavailable
+    _, y_samples = worker_fetch(measurement, [field], ts=ts, nb=nb)
+    y_samples = y_samples[0]
+    if not len(y_samples) or np.isnan(y_samples).any():
+        return None
+    nb = len(y_samples)
+    x = np.linspace(0.0, (nb - 1) * ts, nb)
+    xf, ya = fft_spectrum(y_samples, ts)
+    return x, y_samples, xf, ya[0]
 
-# request for select last 3 records of "field1" in "test" measurement (mean value by 10s steps)
-req = "SELECT mean(\"field1\") AS f1 FROM \"test\" GROUP BY time(10s) fill(null) ORDER BY time DESC LIMIT 400"
 
-# format data and check all data is available
-l_points = []
-for point in client.query(req).get_points():
-    if point['f1'] is None:
-        print("data unavailable, skip fft", file=sys.stderr)
-        exit(1)
-    l_points.append(point['f1'])
+def decimate(x, y, method="minmax", width=1000):
+    # reduce a series to about 2 points by pixel of width before plotting
+    if method == "minmax":
+        return minmax(x, y, width)
+    elif method == "lttb":
+        return lttb(x, y, 2 * width)
+    return x, y
+
 
-# number of samples
-Ns = len(l_points)
+def draw(fig, x, y, xf, ya, title=None):
+    # signal and spectrum subplots
+    ax = fig.add_subplot(211)
+    ax.plot(x, y)
+    ax.set_ylabel("sig. value vs time (s)")
+    ax.grid()
+    if title:
+        ax.set_title(title)
+    ax = fig.add_subplot(212)
+    ax.plot(xf, ya)
+    ax.set_ylabel("sig. level (%) vs freq. (Hz)")
 
-# second between 2 samples
-Ts = 10  # 10 s
 
-# N samples, every sample is time value (in s)
-# 0 -> t_max with Ns items
-t_max = Ts * Ns
-t_samples = np.linspace(0.0, t_max, Ns)
+def export(measurement, field, out_dir, fmt="png", ts=10, nb=400, method="minmax", width=1000, dpi=100):
+    # worker task: fetch, fft, decimate and render one series to out_dir/<measurement>_<field>.<fmt>
+    # without display (Agg canvas of a standalone figure, no pyplot state)
+    from matplotlib.figure import Figure
+    data = load(measurement, field, ts=ts, nb=nb)
+    if data is None:
+        return measurement, field, None
+    x, y, xf, ya = data
+    fig = Figure(figsize=(width / dpi, 0.6 * width / dpi), dpi=dpi)
+    draw(fig, *decimate(x, y, method, width) + decimate(xf, ya, method, width), title="%s:%s" % (measurement, field))
+    path = os.path.join(out_dir, "%s_%s.%s" % (measurement, field, fmt))
+    fig.savefig(path, format=fmt)
+    return measurement, field, path
 
-# convert list to numpy array
-y_samples = np.asarray(l_points)
 
-# build signal
-nb = len(y_samples)
-x = np.linspace(0.0, (nb - 1) * Ts, nb)
+# main program
+if __name__ == "__main__":
+    timer = StageTimer()
+    timer.mark("import")
+    # parse command line
+    parser = argparse.ArgumentParser(description="plot signal and spectrum of measurement fields "
+                                                 "(interactive or headless export of many series)")
+    parser.add_argument("targets", nargs="*", default=["test:field1"],
+                        help="measurement:field to plot, glob allowed (default: test:field1)")
+    add_source_argument(parser)
+    parser.add_argument("--cache", metavar="DIR", help="local cache of fetched series (query only new points)")
+    parser.add_argument("--cache-size", type=int, default=256, metavar="MB", help="cache size limit (default: 256 MB)")
+    parser.add_argument("-t", "--ts", type=int, default=10, help="second between 2 samples (default: 10)")
+    parser.add_argument("-n", "--samples", type=int, default=400, help="number of samples (default: 400)")
+    parser.add_argument("-o", "--output", metavar="DIR", help="headless mode: write plot files to DIR")
+    parser.add_argument("-f", "--format", choices=("png", "svg"), default="png", help="file format (default: png)")
+    parser.add_argument("-d", "--decimate", choices=("minmax", "lttb", "none"), default="minmax",
+                        help="decimation of long series to the plot width (default: minmax)")
+    parser.add_argument("-w", "--width", type=int, default=1000, help="plot width in pixels (default: 1000)")
+    parser.add_argument("--dpi", type=int, default=100, help="plot resolution (default: 100)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("--profile", action="store_true", help="report import and stage timings to stderr")
+    args = parser.parse_args()
+    timer.enabled = args.profile
+    timer.mark("args")
 
-# compute fft
-yf = fftpack.fft(y_samples)
-xf = np.linspace(0.0, 1.0 / (2.0 * Ts), nb // 2)
-ya = 2.0 / nb * np.abs(yf[:nb // 2])
+    # connect to data source
+    init_worker(args.source, args.cache, args.cache_size)
+    d_targets = expand_targets(Worker.source, args.targets)
+    l_targets = [(m, f) for m, fields in sorted(d_targets.items()) for f in fields]
+    timer.mark("connect")
 
-# normalize ya to % of signal
-ya = ya * 100.0 / ya.sum()
+    # headless mode: render all series in parallel (process pool is only loaded here)
+    if args.output:
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+        os.makedirs(args.output, exist_ok=True)
+        n_skip = 0
+        with ProcessPoolExecutor(max_workers=args.jobs, initializer=init_worker,
+                                 initargs=(args.source, args.cache)) as executor:
+            l_futures = [executor.submit(export, m, f, args.output, fmt=args.format, ts=args.ts, nb=args.samples,
+                                         method=args.decimate, width=args.width, dpi=args.dpi)
+                         for m, f in l_targets]
+            for future in as_completed(l_futures):
+                measurement, field, path = future.result()
+                if path is None:
+                    n_skip += 1
+                    print("%s:%s: data unavailable, skip plot" % (measurement, field), file=sys.stderr)
+                else:
+                    print(path)
+        # cache size limit is enforced once all workers are done
+        if Worker.cache:
+            Worker.cache.evict()
+        timer.mark("export")
+        timer.report()
+        exit(1 if n_skip else 0)
+
+    # interactive mode: plot the first series
+    measurement, field = l_targets[0]
+    data = load(measurement, field, ts=args.ts, nb=args.samples)
+    if data is None:
+        print("data unavailable, skip fft", file=sys.stderr)
+        exit(1)
+    x, y_samples, xf, ya = data
+    timer.mark("fetch")
 
-# plot 1 data
-plt.subplot(211)
-plt.plot(x, y_samples)
-plt.ylabel("sig. value vs time (s)")
-plt.grid()
+    # matplotlib is only loaded when there is something to plot
+    import matplotlib.pyplot as plt
+    timer.mark("matplotlib")
 
-# plot 2 spectrum
-plt.subplot(212)
-plt.plot(xf, ya)
-plt.ylabel("sig. level (%) vs freq. (Hz)")
-plt.show()
+    # plot signal and spectrum
+    draw(plt.gcf(), *decimate(x, y_samples, args.decimate, args.width) + decimate(xf, ya, args.decimate, args.width))
+    timer.mark("plot")
+    timer.report()
+    plt.show()
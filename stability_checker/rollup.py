@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import sys
+import numpy as np
+from datasource import add_source_argument, open_source
+from ts_cache import SeriesCache
+
+
+# some const
+STATS = ("mean", "min", "max", "count")
+
+
+# some functions
+def aggregate(t_samples, stats, step):
+    # aggregate stats rows (mean, min, max, count) of sorted timestamps by buckets of step seconds
+    b_samples = t_samples // step * step
+    starts = np.flatnonzero(np.r_[True, b_samples[1:] != b_samples[:-1]])
+    count = np.add.reduceat(stats[3], starts)
+    mean = np.add.reduceat(stats[0] * stats[3], starts) / count
+    return b_samples[starts], np.vstack((mean, np.minimum.reduceat(stats[1], starts),
+                                         np.maximum.reduceat(stats[2], starts), count))
+
+
+# some class
+class RollupStore:
+    # multi-resolution pyramid of series: mean, min, max (and count) by levels of bucket steps
+    # (default 1 s -> 10 s -> 1 min -> 10 min), every level is stored as SeriesCache series
+    # and updated incrementally: only buckets touched by new data are recomputed
+    def __init__(self, root, levels=(1, 10, 60, 600)):
+        self.levels = tuple(levels)
+        self.cache = SeriesCache(root, max_bytes=None)
+
+    def _key(self, measurement, field, stat, step):
+        return measurement, "%s.%s" % (field, stat), step
+
+    def _read_level(self, measurement, field, step, t_min=None, t_max=None):
+        l_rows = [self.cache.read(self._key(measurement, field, stat, step), t_min=t_min, t_max=t_max)
+                  for stat in STATS]
+        return np.asarray(l_rows[0][0]), np.vstack([row for _, row in l_rows])
+
+    def _write_level(self, measurement, field, step, t_samples, stats):
+        for stat, row in zip(STATS, stats):
+            self.cache.append(self._key(measurement, field, stat, step), t_samples, row)
+
+    def tail(self, measurement, field):
+        return self.cache.tail(self._key(measurement, field, "mean", self.levels[0]))
+
+    def update(self, measurement, field, t_samples, y_samples, merge=True):
+        # add new samples (chronological order, epoch in s) to the pyramid
+        # merge: samples are combined with cached buckets (live feed of raw samples), otherwise cached
+        # buckets from the first new one are replaced (resync of already aggregated data)
+        t_samples = np.asarray(t_samples, dtype=np.int64)
+        y_samples = np.asarray(y_samples, dtype=float)
+        is_ok = ~np.isnan(y_samples)
+        t_samples, y_samples = t_samples[is_ok], y_samples[is_ok]
+        if not len(t_samples):
+            return
+        # finest level from raw samples
+        step = self.levels[0]
+        t_b, stats = aggregate(t_samples, np.vstack((y_samples, y_samples, y_samples, np.ones_like(y_samples))), step)
+        if merge:
+            t_c, stats_c = self._read_level(measurement, field, step, t_min=t_b[0])
+            if len(t_c):
+                t_all = np.concatenate((t_c, t_b))
+                order = np.argsort(t_all, kind="stable")
+                t_b, stats = aggregate(t_all[order], np.concatenate((stats_c, stats), axis=1)[:, order], step)
+        self._write_level(measurement, field, step, t_b, stats)
+        # coarser levels: recompute from the level below, starting at the first touched bucket
+        t_start = t_b[0]
+        for prev_step, step in zip(self.levels[:-1], self.levels[1:]):
+            t_start = t_start // step * step
+            t_p, stats_p = self._read_level(measurement, field, prev_step, t_min=t_start)
+            if len(t_p):
+                self._write_level(measurement, field, step, *aggregate(t_p, stats_p, step))
+
+    def sync(self, source, measurement, fields, history=86400):
+        # fetch new data of fields from a data source at the finest level step and update the pyramid
+        # (the last cached bucket is refetched: it may have been partial)
+        step = self.levels[0]
+        tails = [self.tail(measurement, f) for f in fields]
+        if None in tails:
+            t_samples, y_samples = source.fetch(measurement, fields, ts=step, nb=history // step)
+        else:
+            t_samples, y_samples = source.fetch(measurement, fields, ts=step, nb=None, t_min=min(tails))
+        for field, y in zip(fields, y_samples):
+            self.update(measurement, field, t_samples, y, merge=False)
+
+    def read(self, measurement, field, t_min=None, t_max=None, resolution=None):
+        # read the coarsest level with a step <= resolution (in s, default finest level)
+        # return step, timestamps and stats (mean, min, max rows)
+        l_steps = [s for s in self.levels if resolution is not None and s <= resolution]
+        step = max(l_steps) if l_steps else self.levels[0]
+        t_samples, stats = self._read_level(measurement, field, step, t_min=t_min, t_max=t_max)
+        return step, t_samples, stats[:3]
+
+    def read_points(self, measurement, field, t_min, t_max, max_points=1000):
+        # read [t_min, t_max] at a resolution giving about max_points buckets (plot resolution)
+        return self.read(measurement, field, t_min=t_min, t_max=t_max, resolution=(t_max - t_min) / max_points)
+
+
+# main program
+if __name__ == "__main__":
+    # parse command line
+    parser = argparse.ArgumentParser(description="maintain and read mean/min/max rollups of measurement fields")
+    parser.add_argument("root", help="rollup store directory")
+    parser.add_argument("fields", nargs="+", help="fields to sync or read")
+    parser.add_argument("-m", "--measurement", default="test", help="measurement (default: test)")
+    add_source_argument(parser, default=None, description="sync rollups from this data source before read")
+    parser.add_argument("--history", type=int, default=86400, help="history of first sync in s (default: 86400)")
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 10, 60, 600],
+                        help="bucket steps of levels in s (default: 1 10 60 600)")
+    parser.add_argument("--t-min", type=int, help="read from this timestamp (epoch in s)")
+    parser.add_argument("--t-max", type=int, help="read up to this timestamp (epoch in s)")
+    parser.add_argument("-r", "--resolution", type=float, help="read resolution in s (default: finest level)")
+    args = parser.parse_args()
+
+    store = RollupStore(args.root, levels=args.levels)
+    if args.source:
+        store.sync(open_source(args.source), args.measurement, args.fields, history=args.history)
+
+    # dump as csv
+    for field in args.fields:
+        step, t_samples, stats = store.read(args.measurement, field, t_min=args.t_min, t_max=args.t_max,
+                                            resolution=args.resolution)
+        print("# %s:%s step = %d s" % (args.measurement, field, step), file=sys.stderr)
+        print("time,%s_mean,%s_min,%s_max" % (field, field, field))
+        for t, mean, y_min, y_max in zip(t_samples.tolist(), *stats.tolist()):
+            print("%d,%g,%g,%g" % (t, mean, y_min, y_max))
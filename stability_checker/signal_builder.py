@@ -1,39 +1,113 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import math
+import argparse
 import sys
 import time
 import traceback
-from influxdb import InfluxDBClient
-
-# connect to influxdb DB
-client = InfluxDBClient(host="localhost", port=8086)
-client.switch_database("mydb")
-
-while True:
-    try:
-        # update metrics
-        sin_values = 400
-        sin_values += math.sin(2 * math.pi * 1/100 * time.time()) * 100
-        sin_values += math.sin(2 * math.pi * 1/300 * time.time()) * 100
-        sin_values = round(sin_values)
-        # write to influx db
-        l_metrics = [
-            {
-                "measurement": "test",
-                "fields": {
-                    "field1": sin_values,
+import numpy as np
+
+
+# some functions
+def sin_signal(t, noise=0.0, rng=None, phase=0.0):
+    # test signal at time t (in s, scalar or array): 400 + two sines of 100 s and 300 s periods
+    # optional gaussian noise of noise standard deviation and phase shift (in s)
+    value = 400
+    value += np.sin(2 * np.pi * 1/100 * (t + phase)) * 100
+    value += np.sin(2 * np.pi * 1/300 * (t + phase)) * 100
+    if noise:
+        rng = np.random.default_rng() if rng is None else rng
+        value = value + rng.normal(0.0, noise, np.shape(value))
+    return value
+
+
+def bulk_batches(t_start, t_end, rate=1.0, n_loops=1, noise=0.0, measurement="test", field="field1",
+                 batch_size=50000, seed=None):
+    # generate line protocol batches of history from t_start to t_end (epoch in s) at rate samples/s
+    # for n_loops series (one measurement <measurement>_XXXX by loop, every series has its own phase) or
+    # only measurement if n_loops is 1, timestamps are in ms
+    # values are rounded integers like live mode ones (a field keep the same type in both modes)
+    rng = np.random.default_rng(seed)
+    phases = rng.uniform(0.0, 300.0, n_loops) if n_loops > 1 else np.zeros(1)
+    measurements = ["%s_%04d" % (measurement, i) for i in range(n_loops)] if n_loops > 1 else [measurement]
+    n_samples = int((t_end - t_start) * rate)
+    # samples by batch (all loops of a sample are in the same batch)
+    step = max(1, batch_size // n_loops)
+    for i in range(0, n_samples, step):
+        t = t_start + np.arange(i, min(i + step, n_samples)) / rate
+        # values of every loops at once (loops x samples)
+        values = np.round(sin_signal(t[None, :], noise=noise, rng=rng, phase=phases[:, None])).astype(np.int64)
+        t_ms = np.round(t * 1000).astype(np.int64).tolist()
+        yield ["%s %s=%di %d" % (m, field, v, ts) for m, row in zip(measurements, values.tolist())
+               for v, ts in zip(row, t_ms)]
+
+
+# main program
+if __name__ == "__main__":
+    # parse command line
+    parser = argparse.ArgumentParser(description="write test signal to influxdb (live or bulk backfill)")
+    parser.add_argument("--host", default="localhost", help="influxdb host (default: localhost)")
+    parser.add_argument("--port", type=int, default=8086, help="influxdb port (default: 8086)")
+    parser.add_argument("--db", default="mydb", help="influxdb database (default: mydb)")
+    parser.add_argument("-m", "--measurement",
+                        help="influxdb measurement, prefix of loop measurements with --loops (default: test, "
+                             "loop with --loops)")
+    parser.add_argument("-f", "--field", default="field1", help="influxdb field (default: field1)")
+    parser.add_argument("--bulk", action="store_true", help="backfill history instead of live writes")
+    parser.add_argument("--days", type=float, default=1.0, help="bulk: history length in days (default: 1)")
+    parser.add_argument("--rate", type=float, default=1.0, help="bulk: samples by second (default: 1)")
+    parser.add_argument("--loops", type=int, default=1,
+                        help="bulk: number of series, measurements <measurement>_XXXX if more than 1 (default: 1)")
+    parser.add_argument("--noise", type=float, default=0.0, help="bulk: noise standard deviation (default: 0)")
+    parser.add_argument("--batch-size", type=int, default=50000, help="bulk: points by write (default: 50000)")
+    parser.add_argument("--gzip", action="store_true", help="bulk: gzip compress write requests")
+    args = parser.parse_args()
+    if args.measurement is None:
+        args.measurement = "loop" if args.bulk and args.loops > 1 else "test"
+
+    from influxdb import InfluxDBClient
+
+    # connect to influxdb DB
+    if args.gzip:
+        client = InfluxDBClient(host=args.host, port=args.port, gzip=True)
+    else:
+        client = InfluxDBClient(host=args.host, port=args.port)
+    client.switch_database(args.db)
+
+    # bulk mode: backfill days of history up to now with large timestamped batches
+    if args.bulk:
+        t_end = time.time()
+        t_start = t_end - args.days * 86400
+        n_points = 0
+        t0 = time.perf_counter()
+        for lines in bulk_batches(t_start, t_end, rate=args.rate, n_loops=args.loops, noise=args.noise,
+                                  measurement=args.measurement, field=args.field, batch_size=args.batch_size):
+            client.write_points(lines, time_precision="ms", protocol="line")
+            n_points += len(lines)
+        dt = time.perf_counter() - t0
+        print("%d points written in %.1f s (%.0f points/s)" % (n_points, dt, n_points / dt))
+        exit(0)
+
+    while True:
+        try:
+            # update metrics
+            sin_values = round(float(sin_signal(time.time())))
+            # write to influx db
+            l_metrics = [
+                {
+                    "measurement": args.measurement,
+                    "fields": {
+                        args.field: sin_values,
+                    },
                 },
-            },
-        ]
-        client.write_points(points=l_metrics)
-        # wait for next update
-        time.sleep(1.0)
-    except KeyboardInterrupt:
-        break
-    except:
-        # log except to stderr
-        traceback.print_exc(file=sys.stderr)
-        # wait before next try
-        time.sleep(2.0)
+            ]
+            client.write_points(points=l_metrics)
+            # wait for next update
+            time.sleep(1.0)
+        except KeyboardInterrupt:
+            break
+        except:
+            # log except to stderr
+            traceback.print_exc(file=sys.stderr)
+            # wait before next try
+            time.sleep(2.0)
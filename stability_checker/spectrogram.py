@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import sys
+import time
+import numpy as np
+from datasource import add_source_argument, open_source
+from loop_kpi import hold_last
+from spectrum import STFT, format_peak
+
+
+# some functions
+def fetch_chunks(source, measurement, fields, ts, t_start, t_end, chunk=1 << 16):
+    # yield (t_samples, y_samples) of [t_start, t_end[ by chunks of chunk buckets on a continuous grid,
+    # missing buckets hold the last value (leading ones stay nan)
+    t_start = int(t_start) // ts * ts
+    y_last = np.full((len(fields), 1), np.nan)
+    for t_min in range(t_start, int(t_end), chunk * ts):
+        t_max = min(t_min + chunk * ts, int(t_end))
+        t_grid = np.arange(t_min, t_max, ts, dtype=np.int64)
+        y_grid = np.full((len(fields), len(t_grid)), np.nan)
+        t_samples, y_samples = source.fetch(measurement, fields, ts=ts, nb=None, t_min=t_min, t_max=t_max)
+        keep = (t_samples >= t_min) & (t_samples < t_max)
+        y_grid[:, (t_samples[keep] - t_min) // ts] = y_samples[:, keep]
+        y_grid = hold_last(np.concatenate((y_last, y_grid), axis=1))[:, 1:]
+        if len(t_grid):
+            y_last = y_grid[:, -1:]
+        yield t_grid, y_grid
+
+
+def spectrogram(chunks, n_series, ts, nperseg=256, overlap=0.5, window="hann"):
+    # spectrogram of chunked series: return frame center times, frequencies and spectra
+    # (series x frames x freqs, in % of signal), only the frames are kept in memory
+    stft = STFT(n_series, ts, nperseg=nperseg, overlap=overlap, window=window)
+    t0 = None
+    l_frames = []
+    for t_samples, y_samples in chunks:
+        if t0 is None and len(t_samples):
+            t0 = t_samples[0]
+        l_frames.append(stft.update(y_samples))
+    frames = np.concatenate(l_frames, axis=1) if l_frames else np.empty((n_series, 0, nperseg // 2))
+    t_frames = (t0 or 0) + (np.arange(frames.shape[1]) * stft.step + nperseg / 2) * ts
+    return t_frames, stft.xf, frames
+
+
+def find_episodes(t_frames, xf, frames, level=3.0, f_min=None, f_max=None, min_frames=3):
+    # intermittent oscillations: runs of at least min_frames frames with a peak over level in the band
+    # (DC excluded), return a list of (series, t_start, t_end, freq, level) with the mean dominant
+    # frequency and the max level of every episode
+    is_band = xf > 0
+    if f_min is not None:
+        is_band &= xf >= f_min
+    if f_max is not None:
+        is_band &= xf <= f_max
+    band = np.nan_to_num(frames[:, :, is_band], nan=0.0)
+    if not band.shape[-1] or not band.shape[1]:
+        return []
+    f_peak = xf[is_band][band.argmax(axis=-1)]
+    m_peak = band.max(axis=-1)
+    # runs of oscillating frames by series
+    pad = np.zeros((frames.shape[0], 1), dtype=np.int8)
+    edges = np.diff(np.concatenate((pad, (m_peak > level).astype(np.int8), pad), axis=1), axis=1)
+    rows, starts = np.nonzero(edges == 1)
+    _, ends = np.nonzero(edges == -1)
+    f_sum = np.concatenate((pad, np.cumsum(f_peak, axis=1)), axis=1)
+    return [(row, t_frames[s], t_frames[e - 1], (f_sum[row, e] - f_sum[row, s]) / (e - s), m_peak[row, s:e].max())
+            for row, s, e in zip(rows, starts, ends) if e - s >= min_frames]
+
+
+# main program
+if __name__ == "__main__":
+    # parse command line
+    parser = argparse.ArgumentParser(description="spectrogram of long histories and intermittent oscillation episodes")
+    parser.add_argument("fields", nargs="*", default=["field1"], help="fields to analyze (default: field1)")
+    parser.add_argument("-m", "--measurement", default="test", help="measurement (default: test)")
+    add_source_argument(parser)
+    parser.add_argument("-t", "--ts", type=int, default=10, help="second between 2 samples (default: 10)")
+    parser.add_argument("--days", type=float, default=30.0, help="history length in days (default: 30)")
+    parser.add_argument("--end", type=int, help="history end (epoch in s, default: now)")
+    parser.add_argument("--nperseg", type=int, default=256, help="samples by frame (default: 256)")
+    parser.add_argument("--overlap", type=float, default=0.5, help="frames overlap ratio (default: 0.5)")
+    parser.add_argument("--chunk", type=int, default=1 << 16, help="buckets fetched by query (default: 65536)")
+    parser.add_argument("-l", "--level", type=float, default=3.0, help="peak level threshold in %% (default: 3.0)")
+    parser.add_argument("-b", "--band", type=float, nargs=2, metavar=("FMIN", "FMAX"),
+                        help="frequency band of interest in Hz (default: all but DC)")
+    parser.add_argument("--min-frames", type=int, default=3, help="min episode length in frames (default: 3)")
+    parser.add_argument("-o", "--output", metavar="FILE", help="save time x frequency matrix to FILE (.npz)")
+    args = parser.parse_args()
+
+    # stream the history through the STFT
+    source = open_source(args.source)
+    t_end = (int(time.time()) if args.end is None else args.end) // args.ts * args.ts
+    t_start = t_end - int(args.days * 86400)
+    chunks = fetch_chunks(source, args.measurement, args.fields, args.ts, t_start, t_end, chunk=args.chunk)
+    t_frames, xf, frames = spectrogram(chunks, len(args.fields), args.ts, nperseg=args.nperseg, overlap=args.overlap)
+    if args.output:
+        np.savez(args.output, t=t_frames, f=xf, s=frames, fields=np.array(args.fields))
+
+    # print episodes
+    f_min, f_max = args.band if args.band else (None, None)
+    episodes = find_episodes(t_frames, xf, frames, level=args.level, f_min=f_min, f_max=f_max,
+                             min_frames=args.min_frames)
+    for row, t0, t1, f, m in episodes:
+        print("%s: %s -> %s (%.1f h), %s" % (args.fields[row], time.ctime(t0), time.ctime(t1), (t1 - t0) / 3600,
+                                             format_peak(f, m)))
+    print("# %d frames of %d s, %d episodes" % (frames.shape[1], args.nperseg * args.ts, len(episodes)),
+          file=sys.stderr)
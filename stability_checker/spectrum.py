@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import sys
+import numpy as np
+
+
+# some functions
+def fft_amplitude(y_samples, ts):
+    # y_samples is a batch of series (series x samples), a 1D array is a batch of one
+    y_samples = np.atleast_2d(np.asarray(y_samples, dtype=float))
+    nb = y_samples.shape[-1]
+    # compute real fft of every series in one call (half spectrum only)
+    yf = np.fft.rfft(y_samples, axis=-1)
+    xf = np.fft.rfftfreq(nb, ts)[:nb // 2]
+    ya = 2.0 / nb * np.abs(yf[:, :nb // 2])
+    return xf, ya
+
+
+def normalize(ya):
+    # normalize ya to % of signal (series by series), a null signal give nan
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return ya * 100.0 / ya.sum(axis=-1, keepdims=True)
+
+
+def fft_spectrum(y_samples, ts):
+    xf, ya = fft_amplitude(y_samples, ts)
+    return xf, normalize(ya)
+
+
+def welch_spectrum(y_samples, ts, nperseg=1024, overlap=0.5, window="hann", chunk=1 << 20):
+    # welch averaged spectrum of a batch of series, long (or memory-mapped) arrays are read by chunks
+    y_samples = np.atleast_2d(y_samples)
+    welch = WelchSpectrum(y_samples.shape[0], ts, nperseg=min(nperseg, y_samples.shape[-1]),
+                          overlap=overlap, window=window)
+    for i in range(0, y_samples.shape[-1], chunk):
+        welch.update(y_samples[:, i:i + chunk])
+    return welch.spectrum()
+
+
+def lomb_spectrum(t_samples, y_samples, ts):
+    # spectrum of gappy series (nan samples are missing ones) with the fast Lomb-Scargle periodogram
+    # (Press & Rybicki, O(N log N)), same frequencies and % normalisation as fft_spectrum
+    y_samples = np.atleast_2d(np.asarray(y_samples, dtype=float))
+    t_samples = np.asarray(t_samples, dtype=float)
+    nb = y_samples.shape[-1]
+    xf = np.fft.rfftfreq(nb, ts)[:nb // 2]
+    ya = np.full((y_samples.shape[0], len(xf)), np.nan)
+    for i, y in enumerate(y_samples):
+        is_ok = ~np.isnan(y)
+        if is_ok.sum() < 3 or len(xf) < 2:
+            continue
+        # DC level like fft_spectrum (2 x mean), then sine amplitude of every other frequency
+        y_mean = y[is_ok].mean()
+        ya[i, 0] = 2.0 * abs(y_mean)
+        power = lomb_scargle(t_samples[is_ok], y[is_ok] - y_mean, xf[1], xf[1] - xf[0], len(xf) - 1)
+        ya[i, 1:] = np.sqrt(2.0 * np.maximum(power, 0.0))
+    return xf, normalize(ya)
+
+
+def lomb_scargle(t, y, f0, df, nf, oversampling=5):
+    # fast Lomb-Scargle for a centered series y at frequencies f0 + df * k (k < nf)
+    # return the mean power (sine of amplitude a give a^2 / 2)
+    sh, ch = _trig_sum(t, y / len(y), f0, df, nf, oversampling)
+    s2, c2 = _trig_sum(t, np.full(len(t), 1.0 / len(t)), 2 * f0, 2 * df, nf, oversampling)
+    # time shift tau of every frequency
+    hypo = np.hypot(s2, c2)
+    c2w = np.where(hypo > 0, c2 / np.where(hypo > 0, hypo, 1.0), 1.0)
+    s2w = np.where(hypo > 0, s2 / np.where(hypo > 0, hypo, 1.0), 0.0)
+    cw = np.sqrt(0.5 * (1 + c2w))
+    sw = np.sign(s2w) * np.sqrt(0.5 * np.maximum(1 - c2w, 0.0))
+    # periodogram
+    yc = ch * cw + sh * sw
+    ys = sh * cw - ch * sw
+    cc = 0.5 * (1 + c2 * c2w + s2 * s2w)
+    ss = 0.5 * (1 - c2 * c2w - s2 * s2w)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.nan_to_num(yc * yc / cc) + np.nan_to_num(ys * ys / ss)
+
+
+def _trig_sum(t, h, f0, df, nf, oversampling=5, m=4):
+    # sums of h * sin(2 pi f t) and h * cos(2 pi f t) for f = f0 + df * k (k < nf)
+    # h is extirpolated on a regular grid, then all sums are computed with one fft
+    n_fft = 1 << int(np.ceil(np.log2(max(nf * oversampling, m + 1))))
+    t0 = t.min()
+    h = h * np.exp(2j * np.pi * f0 * (t - t0))
+    t_grid = ((t - t0) * df) % 1 * n_fft
+    yf = np.fft.ifft(_extirpolate(t_grid, h, n_fft, m))[:nf] * n_fft
+    yf *= np.exp(2j * np.pi * t0 * (f0 + df * np.arange(nf)))
+    return yf.imag, yf.real
+
+
+def _extirpolate(x, y, n, m=4):
+    # spread y values at (non integer) x positions on n regular points, so that a sum of
+    # y * f(x) is matched by the grid for any smooth f (Press & Rybicki "reverse interpolation")
+    result = np.zeros(n, dtype=y.dtype)
+    is_int = x % 1 == 0
+    np.add.at(result, x[is_int].astype(int) % n, y[is_int])
+    x, y = x[~is_int], y[~is_int]
+    i_lo = np.clip((x - m // 2).astype(int), 0, n - m)
+    num = y * np.prod(x - i_lo - np.arange(m)[:, None], axis=0)
+    den = float(np.prod(np.arange(1, m)))
+    for j in range(m):
+        if j > 0:
+            den *= j / (j - m)
+        idx = i_lo + (m - 1 - j)
+        np.add.at(result, idx, num / (den * (x - idx)))
+    return result
+
+
+def auto_spectra(t_samples, y_samples, ts, nperseg=None):
+    # spectrum of every series (nan samples are missing ones): fft (welch if nperseg is set) for
+    # complete series, Lomb-Scargle for gappy ones, None for series without enough data
+    # return a list of (xf, ya) by series
+    y_samples = np.atleast_2d(y_samples)
+    n_ok = (~np.isnan(y_samples)).sum(axis=1)
+    is_full = (n_ok == y_samples.shape[-1]) & (n_ok > 0)
+    is_gappy = ~is_full & (n_ok >= 3)
+    l_spectra = [None] * y_samples.shape[0]
+    if is_full.any():
+        if nperseg:
+            xf, ya = welch_spectrum(y_samples[is_full], ts, nperseg=nperseg)
+        else:
+            xf, ya = fft_spectrum(y_samples[is_full], ts)
+        for i, row in zip(np.nonzero(is_full)[0], ya):
+            l_spectra[i] = (xf, row)
+    if is_gappy.any():
+        xf, ya = lomb_spectrum(t_samples, y_samples[is_gappy], ts)
+        for i, row in zip(np.nonzero(is_gappy)[0], ya):
+            l_spectra[i] = (xf, row)
+    return l_spectra
+
+
+def zoom_dft(y, ts, f_start, df, m):
+    # DFT of series y at m frequencies f_start + k * df (k < m) with the chirp-z transform (Bluestein)
+    # f_start may be an array: one zoomed band by row of the result (bands x m)
+    y = np.asarray(y, dtype=float)
+    f_start = np.atleast_1d(f_start)
+    nb = y.shape[-1]
+    n = np.arange(nb)
+    n_fft = 1 << int(np.ceil(np.log2(nb + m - 1)))
+    # chirp W^(j^2 / 2) with W = exp(-2j pi df ts)
+    def chirp(j):
+        return np.exp(-1j * np.pi * df * ts * j.astype(float) ** 2)
+    u = y * np.exp(-2j * np.pi * f_start[:, None] * ts * n) * chirp(n)
+    v = 1.0 / chirp(np.arange(-(nb - 1), m))
+    conv = np.fft.ifft(np.fft.fft(u, n_fft, axis=-1) * np.fft.fft(v, n_fft), axis=-1)
+    return conv[:, nb - 1:nb - 1 + m] * chirp(np.arange(m))
+
+
+def refine_peaks(y_samples, ts, l_peaks, span=2.0, m=64):
+    # sub-bin frequency and level of every peak: zoom DFT on +/- span bins around the coarse peak
+    # frequency then parabolic interpolation of the magnitude, DC peaks are kept unchanged
+    # return a list of peaks arrays (one per series, rows are (freq, level in %)) like find_peaks
+    y_samples = np.atleast_2d(np.asarray(y_samples, dtype=float))
+    nb = y_samples.shape[-1]
+    df_bin = 1.0 / (nb * ts)
+    dz = 2.0 * span * df_bin / (m - 1)
+    _, ya = fft_amplitude(y_samples, ts)
+    l_refined = []
+    for y, amp_sum, peaks in zip(y_samples, ya.sum(axis=-1), l_peaks):
+        peaks = np.array(peaks, dtype=float).reshape(-1, 2)
+        is_ac = peaks[:, 0] > 0
+        if is_ac.any():
+            # all bands of a series in one chirp-z call, mean is removed to avoid DC leakage
+            mag = np.abs(zoom_dft(y - y.mean(), ts, peaks[is_ac, 0] - span * df_bin, dz, m))
+            i = np.clip(mag.argmax(axis=-1), 1, m - 2)
+            a, b, c = (mag[np.arange(len(i)), i + k] for k in (-1, 0, 1))
+            with np.errstate(divide="ignore", invalid="ignore"):
+                delta = np.nan_to_num(0.5 * (a - c) / (a - 2 * b + c))
+            delta = np.clip(delta, -0.5, 0.5)
+            f_ref = peaks[is_ac, 0] - span * df_bin + (i + delta) * dz
+            amp = 2.0 / nb * (b - 0.25 * (a - c) * delta)
+            peaks[is_ac] = np.column_stack((f_ref, amp * 100.0 / amp_sum))
+            # coarse peaks of adjacent bins may converge to the same frequency: keep the strongest
+            peaks = peaks[np.argsort(-peaks[:, 1], kind="stable")]
+            keep = [k for k in range(len(peaks))
+                    if not any(abs(peaks[k, 0] - peaks[p, 0]) < 0.5 * df_bin for p in range(k))]
+            peaks = peaks[sorted(keep, key=lambda k: peaks[k, 0])]
+        l_refined.append(peaks)
+    return l_refined
+
+
+def autocorr(y_samples, max_lag=None):
+    # normalized autocorrelation (series x lags) of every series by FFT (Wiener-Khinchin, O(N log N))
+    # mean is removed, missing samples (nan) count as mean value, max_lag default to half the series
+    y = np.atleast_2d(y_samples).astype(float)
+    y = np.nan_to_num(y - np.nanmean(y, axis=1, keepdims=True))
+    nb = y.shape[1]
+    max_lag = nb // 2 if max_lag is None else min(max_lag, nb - 1)
+    # zero padding to 2 nb: linear (not circular) correlation
+    n_fft = 1 << int(2 * nb - 1).bit_length()
+    yf = np.fft.rfft(y, n_fft, axis=1)
+    acf = np.fft.irfft(yf.real ** 2 + yf.imag ** 2, n_fft, axis=1)[:, :max_lag + 1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return acf / acf[:, :1]
+
+
+def acf_oscillation(y_samples, ts, n_cross=11, r_min=1.0):
+    # oscillation detection from the autocorrelation of every series (Thornhill regularity):
+    # intervals between the first n_cross zero crossings of the ACF give periods Tp = 2 * interval
+    # (crossings within the ACF noise band are ignored), regularity r = mean(Tp) / (3 * std(Tp)),
+    # a series oscillates if r > r_min
+    # return period (in s), regularity and oscillating flag arrays (nan if less than 4 crossings)
+    acf = autocorr(y_samples)
+    n_lags = acf.shape[1]
+    # zero crossings with hysteresis: the ACF must leave the noise band (95 % bound of white noise ACF)
+    # on the other side, noise wiggles around zero don't count
+    band = 1.96 / np.sqrt(np.atleast_2d(y_samples).shape[1])
+    side = np.where(acf > band, 1, np.where(acf < -band, -1, 0))
+    pos = np.where(side != 0, np.arange(n_lags), 0)
+    np.maximum.accumulate(pos, axis=1, out=pos)
+    side = np.take_along_axis(side, pos, axis=1)
+    rows, lags = np.nonzero((side[:, 1:] != side[:, :-1]) & (side[:, :-1] != 0))
+    # crossing is the last sign change before the band exit, linear interpolated between lags
+    sign_pos = np.zeros(acf.shape, dtype=np.int64)
+    sign_pos[:, 1:] = np.where((acf[:, 1:] > 0) != (acf[:, :-1] > 0), np.arange(n_lags - 1), 0)
+    np.maximum.accumulate(sign_pos, axis=1, out=sign_pos)
+    lags = sign_pos[rows, lags + 1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t_cross = (lags + acf[rows, lags] / (acf[rows, lags] - acf[rows, lags + 1])) * ts
+    # first n_cross crossings of every series (series x n_cross, nan padded)
+    rank = np.arange(len(rows)) - np.searchsorted(rows, rows)
+    keep = rank < n_cross
+    crosses = np.full((acf.shape[0], n_cross), np.nan)
+    crosses[rows[keep], rank[keep]] = t_cross[keep]
+    tp = 2 * np.diff(crosses, axis=1)
+    n_tp = np.sum(~np.isnan(tp), axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        period = np.where(n_tp >= 3, np.nansum(tp, axis=1) / n_tp, np.nan)
+        std = np.sqrt(np.nansum((tp - period[:, None]) ** 2, axis=1) / n_tp)
+        regularity = np.where(n_tp >= 3, period / (3 * std), np.nan)
+    return period, regularity, regularity > r_min
+
+
+def find_peaks(xf, ya, level=3.0):
+    # return a list of peaks arrays (one per series), every row is (freq, level in %)
+    ya = np.atleast_2d(ya)
+    rows, cols = np.nonzero(ya > level)
+    peaks = np.column_stack((xf[cols], ya[rows, cols]))
+    return np.split(peaks, np.searchsorted(rows, np.arange(1, ya.shape[0])))
+
+
+def plan_window(f_min, f_max, oversampling=2.5, n_cycles=10, ts_min=1, nb_max=100000):
+    # choose the bucket step (in s) and window length (in samples) to analyze the [f_min, f_max] band:
+    # step is the coarsest one that keep f_max under Nyquist with an oversampling margin, window is
+    # long enough to hold n_cycles periods of f_min (frequency resolution = f_min / n_cycles)
+    if not 0 < f_min < f_max:
+        raise ValueError("band %g-%g Hz: need 0 < f_min < f_max" % (f_min, f_max))
+    ts = max(int(ts_min), int(1.0 / (oversampling * f_max)))
+    if ts * oversampling * f_max > 1:
+        print("band %g-%g Hz: step %d s is too coarse, max %g Hz with %gx oversampling" %
+              (f_min, f_max, ts, 1.0 / (oversampling * ts), oversampling), file=sys.stderr)
+    nb = int(np.ceil(n_cycles / (f_min * ts)))
+    nb = max(16, nb + nb % 2)
+    if nb > nb_max:
+        print("band %g-%g Hz: window clipped to %d samples, resolution is %g Hz (not %g Hz)" %
+              (f_min, f_max, nb_max, 1.0 / (nb_max * ts), f_min / n_cycles), file=sys.stderr)
+        nb = nb_max
+    return ts, nb
+
+
+def band_peaks(l_peaks, f_min, f_max):
+    # keep only peaks inside [f_min, f_max]
+    return [peaks[(peaks[:, 0] >= f_min) & (peaks[:, 0] <= f_max)] for peaks in l_peaks]
+
+
+def format_peak(f, m):
+    if f > 0:
+        return "freq = %.4f Hz, level = %.2f %%,  period = %.2f s" % (f, m, 1/f)
+    else:
+        return "freq = %.4f Hz, level = %.2f %%" % (f, m)
+
+
+def format_acf(period, regularity, osc):
+    # human readable autocorrelation detector result
+    if np.isnan(period):
+        return "no oscillation"
+    return "period = %.2f s, regularity = %.2f, %s" % (period, regularity, "oscillating" if osc else "irregular")
+
+
+# some class
+class SlidingDFT:
+    # sliding DFT over a rolling window of nb samples for a batch of series
+    # every new sample update the tracked bins in O(bins), default bins match fft_spectrum ones
+    def __init__(self, y_samples, ts, bins=None, resync=None):
+        # y_samples is the initial window (series x samples) in chronological order
+        self.buf = np.atleast_2d(np.array(y_samples, dtype=float))
+        self.ts = ts
+        self.nb = self.buf.shape[-1]
+        self.bins = np.arange(self.nb // 2) if bins is None else np.asarray(bins)
+        self.twiddle = np.exp(2j * np.pi * self.bins / self.nb)
+        # full recompute every resync updates to avoid rounding drift (default: once per window)
+        self.resync = self.nb if resync is None else resync
+        self.pos = 0
+        self._sync()
+
+    def window(self):
+        # current window in chronological order (series x samples)
+        return np.roll(self.buf, -self.pos, axis=-1)
+
+    def _sync(self):
+        # exact DFT of the window (oldest sample first)
+        self.xk = np.fft.rfft(self.window(), axis=-1)[:, self.bins]
+        self.n_update = 0
+
+    def update(self, y_new):
+        # add one new sample for each series, drop the oldest one
+        y_new = np.asarray(y_new, dtype=float).reshape(-1)
+        y_old = self.buf[:, self.pos].copy()
+        self.buf[:, self.pos] = y_new
+        self.pos = (self.pos + 1) % self.nb
+        self.n_update += 1
+        if self.n_update >= self.resync:
+            self._sync()
+        else:
+            self.xk = (self.xk + (y_new - y_old)[:, None]) * self.twiddle
+
+    def update_buckets(self, t_new, y_new, t_min, t_max):
+        # add every bucket of [t_min, t_max[ from fetched ones (t_new, y_new may miss some buckets): missing
+        # buckets and samples hold the last value, so the window stay continuous in time
+        # return a bool array of held buckets (some series was missing)
+        y_grid = np.full((self.buf.shape[0], (int(t_max) - int(t_min)) // self.ts), np.nan)
+        t_new = np.asarray(t_new, dtype=np.int64)
+        keep = (t_new >= t_min) & (t_new < t_max)
+        y_grid[:, (t_new[keep] - int(t_min)) // self.ts] = np.asarray(y_new)[:, keep]
+        is_held = np.isnan(y_grid).any(axis=0)
+        for y in y_grid.T:
+            self.update(np.where(np.isnan(y), self.buf[:, self.pos - 1], y))
+        return is_held
+
+    def spectrum(self):
+        # same frequencies and % normalisation as fft_spectrum
+        xf = np.fft.rfftfreq(self.nb, self.ts)[self.bins]
+        return xf, normalize(2.0 / self.nb * np.abs(self.xk))
+
+
+class WelchSpectrum:
+    # welch averaged amplitude spectrum of a batch of series fed chunk by chunk
+    # memory use depend on nperseg and chunk size, not on the history length
+    WINDOWS = {
+        "boxcar": np.ones,
+        "hann": lambda n: np.hanning(n + 1)[:-1],
+        "hamming": lambda n: np.hamming(n + 1)[:-1],
+        "blackman": lambda n: np.blackman(n + 1)[:-1],
+    }
+
+    def __init__(self, n_series, ts, nperseg=1024, overlap=0.5, window="hann", batch=64):
+        self.ts = ts
+        self.nperseg = nperseg
+        self.step = max(1, nperseg - int(nperseg * overlap))
+        self.win = self.WINDOWS[window](nperseg)
+        # number of segments transformed in one rfft call
+        self.batch = batch
+        # samples not yet used by a complete segment
+        self.tail = np.empty((n_series, 0))
+        self.p_sum = np.zeros((n_series, nperseg // 2 + 1))
+        self.n_seg = 0
+
+    def update(self, y_chunk):
+        # y_chunk is the next samples (series x samples) in chronological order
+        data = np.concatenate((self.tail, np.atleast_2d(y_chunk)), axis=-1)
+        n_seg = max(0, (data.shape[-1] - self.nperseg) // self.step + 1)
+        if n_seg:
+            segs = np.lib.stride_tricks.sliding_window_view(data, self.nperseg, axis=-1)[:, ::self.step][:, :n_seg]
+            for i in range(0, n_seg, self.batch):
+                yf = self._segment_fft(segs[:, i:i + self.batch])
+                self.p_sum += (yf.real ** 2 + yf.imag ** 2).sum(axis=1)
+            self.n_seg += n_seg
+        self.tail = data[:, n_seg * self.step:].copy()
+
+    def _segment_fft(self, seg):
+        # windowed rfft of segments (series x segments x nperseg)
+        # remove mean before windowing to avoid DC leakage, then restore it in bin 0
+        seg_mean = seg.mean(axis=-1)
+        yf = np.fft.rfft((seg - seg_mean[..., None]) * self.win, axis=-1)
+        yf[..., 0] = seg_mean * self.win.sum()
+        return yf
+
+    def spectrum(self):
+        # amplitude of mean power (window gain corrected), normalized to % of signal like fft_spectrum
+        xf = np.fft.rfftfreq(self.nperseg, self.ts)[:self.nperseg // 2]
+        return xf, normalize(2.0 / self.win.sum() * np.sqrt(self.p_sum[:, :self.nperseg // 2] / max(self.n_seg, 1)))
+
+
+class STFT(WelchSpectrum):
+    # short-time spectra (spectrogram frames) of a batch of series fed chunk by chunk
+    # only the samples of the next incomplete segment are kept between chunks: memory use depend on
+    # nperseg and chunk size, not on the history length
+    def __init__(self, n_series, ts, nperseg=256, overlap=0.5, window="hann", batch=64):
+        WelchSpectrum.__init__(self, n_series, ts, nperseg=nperseg, overlap=overlap, window=window, batch=batch)
+        self.xf = np.fft.rfftfreq(self.nperseg, self.ts)[:self.nperseg // 2]
+
+    def update(self, y_chunk):
+        # y_chunk is the next samples (series x samples) in chronological order, return spectra of the
+        # segments completed by this chunk (series x frames x freqs, in % of signal like fft_spectrum),
+        # frame k of the stream start at sample k * step
+        data = np.concatenate((self.tail, np.atleast_2d(y_chunk)), axis=-1)
+        n_seg = max(0, (data.shape[-1] - self.nperseg) // self.step + 1)
+        frames = np.empty((data.shape[0], n_seg, self.nperseg // 2))
+        if n_seg:
+            segs = np.lib.stride_tricks.sliding_window_view(data, self.nperseg, axis=-1)[:, ::self.step][:, :n_seg]
+            for i in range(0, n_seg, self.batch):
+                yf = self._segment_fft(segs[:, i:i + self.batch])
+                frames[:, i:i + self.batch] = normalize(2.0 / self.win.sum() * np.abs(yf[..., :self.nperseg // 2]))
+            self.n_seg += n_seg
+        self.tail = data[:, n_seg * self.step:].copy()
+        return frames
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+import math
+import sched
+import signal
+import sys
+import time
+import traceback
+import numpy as np
+from datasource import InfluxSource, open_source
+from loop_kpi import hold_last
+from spectrum import SlidingDFT, acf_oscillation, band_peaks, find_peaks, plan_window
+
+
+# config example:
+# {
+#   "source": "influx://localhost:8086/mydb",
+#   "output": "influx:stability",
+#   "checks": [
+#     {"measurement": "test", "fields": ["field1"], "ts": 10, "nb": 400, "every": 60, "level": 3.0, "acf": true},
+#     {"measurement": "loop_1", "fields": ["pv", "out"], "band": [0.001, 0.02], "every": 300}
+#   ]
+# }
+
+
+# some class
+class Check:
+    # one scheduled check of measurement fields, the rolling window is kept warm between runs
+    # (sliding DFT state): a run only fetches the buckets completed since the previous one
+    def __init__(self, conf):
+        self.measurement = conf["measurement"]
+        self.fields = conf.get("fields", ["field1"])
+        self.band = conf.get("band")
+        if self.band:
+            self.ts, self.nb = plan_window(*self.band)
+        else:
+            self.ts, self.nb = conf.get("ts", 10), conf.get("nb", 400)
+        self.every = conf.get("every", 60)
+        self.level = conf.get("level", 3.0)
+        self.acf = conf.get("acf", False)
+        self.sdft = None
+        self.t_next = None
+
+    def refresh(self, source):
+        # bring the window up to date with complete buckets, return False if no complete window is available
+        t_end = int(time.time()) // self.ts * self.ts
+        if self.sdft is None or t_end - self.t_next >= self.nb * self.ts:
+            # cold start (or too long gap): full window fetch
+            t_samples, y_samples = source.fetch(self.measurement, self.fields, ts=self.ts, nb=self.nb, t_max=t_end)
+            y_samples = hold_last(y_samples)
+            if len(t_samples) < self.nb or np.isnan(y_samples).any():
+                self.sdft = None
+                return False
+            self.sdft = SlidingDFT(y_samples, self.ts)
+            self.t_next = int(t_samples[-1]) + self.ts
+        elif t_end > self.t_next:
+            t_new, y_new = source.fetch(self.measurement, self.fields, ts=self.ts, nb=None,
+                                        t_min=self.t_next, t_max=t_end)
+            # every bucket up to t_end (missing ones hold the last value)
+            self.sdft.update_buckets(t_new, y_new, self.t_next, t_end)
+            self.t_next = t_end
+        return True
+
+    def run(self, source):
+        # update the window and return result records (one by field)
+        t0 = time.perf_counter()
+        if not self.refresh(source):
+            print("%s: data unavailable, skip check" % self.measurement, file=sys.stderr)
+            return []
+        xf, ya = self.sdft.spectrum()
+        l_peaks = find_peaks(xf, ya, level=self.level)
+        if self.band:
+            l_peaks = band_peaks(l_peaks, *self.band)
+        if self.acf:
+            periods, regularities, is_osc = acf_oscillation(self.sdft.window(), self.ts)
+        latency = time.perf_counter() - t0
+        l_records = []
+        for i, field in enumerate(self.fields):
+            record = {"time": self.t_next - self.ts, "measurement": self.measurement, "field": field,
+                      "peaks": l_peaks[i].tolist(), "latency": latency}
+            if self.acf:
+                record.update(period=float(periods[i]), regularity=float(regularities[i]),
+                              oscillating=bool(is_osc[i]))
+            l_records.append(record)
+        return l_records
+
+
+class JsonlWriter:
+    # write records as json lines to a file (or stdout), non finite values (nan period of a series without
+    # oscillation...) are written as null: lines stay strict json
+    def __init__(self, f):
+        self.f = f
+
+    def write(self, l_records):
+        for record in l_records:
+            record = dict((k, None if isinstance(v, float) and not math.isfinite(v) else v)
+                          for k, v in record.items())
+            self.f.write(json.dumps(record, allow_nan=False) + "\n")
+        self.f.flush()
+
+
+class InfluxWriter:
+    # write records as points of an influxdb measurement (tags loop and field), nan values are omitted
+    def __init__(self, client, measurement="stability"):
+        self.client = client
+        self.measurement = measurement
+
+    def write(self, l_records):
+        l_points = []
+        for record in l_records:
+            fields = {"n_peaks": len(record["peaks"]), "latency": record["latency"]}
+            if record["peaks"]:
+                f, m = max(record["peaks"], key=lambda peak: peak[1])
+                fields.update(main_freq=f, main_level=m)
+            for name in ("period", "regularity", "oscillating"):
+                if name in record and record[name] == record[name]:
+                    fields[name] = record[name]
+            l_points.append({"measurement": self.measurement, "time": int(record["time"]),
+                             "tags": {"loop": record["measurement"], "field": record["field"]}, "fields": fields})
+        if l_points:
+            self.client.write_points(l_points, time_precision="s")
+
+
+# some functions
+def open_output(url, source):
+    # results output: "-" for stdout, jsonl:FILE or influx:MEASUREMENT (written with the source client)
+    scheme, _, path = url.partition(":")
+    if url == "-":
+        return JsonlWriter(sys.stdout)
+    elif scheme == "jsonl":
+        return JsonlWriter(open(path, "a"))
+    elif scheme == "influx":
+        if not isinstance(source, InfluxSource):
+            raise ValueError("output \"%s\" requires an influx:// data source" % url)
+        return InfluxWriter(source.client, path or "stability")
+    raise ValueError("unknown output \"%s\"" % url)
+
+
+def run_check(check, source, output):
+    # run a check and write its results, errors are logged (the daemon keeps running)
+    try:
+        output.write(check.run(source))
+    except Exception:
+        traceback.print_exc(file=sys.stderr)
+
+
+def schedule(scheduler, check, source, output, t_due):
+    # run a check then schedule its next run (missed runs are skipped)
+    run_check(check, source, output)
+    t_due += check.every
+    while t_due <= time.time():
+        t_due += check.every
+    scheduler.enterabs(t_due, 1, schedule, (scheduler, check, source, output, t_due))
+
+
+def on_sigterm(signum, frame):
+    raise KeyboardInterrupt
+
+
+# main program
+if __name__ == "__main__":
+    # parse command line
+    parser = argparse.ArgumentParser(description="stability checks daemon: scheduled checks of many loops "
+                                                 "with warm connections and rolling windows")
+    parser.add_argument("config", help="json config file (source, output and checks list)")
+    parser.add_argument("-o", "--output", help="override config output: -, jsonl:FILE or influx:MEASUREMENT")
+    parser.add_argument("--once", action="store_true", help="run every check once and exit")
+    args = parser.parse_args()
+    with open(args.config) as f:
+        config = json.load(f)
+
+    # warm state: one data source connection and rolling windows kept for the whole daemon life
+    source = open_source(config.get("source", "influx://localhost:8086/mydb"))
+    output = open_output(args.output or config.get("output", "-"), source)
+    l_checks = [Check(conf) for conf in config["checks"]]
+
+    if args.once:
+        for check in l_checks:
+            run_check(check, source, output)
+        exit(0)
+
+    # every check runs at its own cadence, aligned on multiples of its period
+    signal.signal(signal.SIGTERM, on_sigterm)
+    scheduler = sched.scheduler(time.time, time.sleep)
+    t_now = time.time()
+    for check in l_checks:
+        t_due = (t_now // check.every + 1) * check.every
+        scheduler.enterabs(t_due, 1, schedule, (scheduler, check, source, output, t_due))
+    try:
+        # first run of every check now (cold start), then scheduled ones
+        for check in l_checks:
+            run_check(check, source, output)
+        scheduler.run()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import sys
+import time
+
+
+# reference time: entry points import this module first, so the first stage include all module imports
+T_START = time.perf_counter()
+
+
+# some class
+class StageTimer:
+    # wall time of the stages of a command line tool, reported to stderr with --profile
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.t_last = T_START
+        self.l_stages = []
+
+    def mark(self, name):
+        # end of stage name (started at the previous mark)
+        t_now = time.perf_counter()
+        self.l_stages.append((name, t_now - self.t_last))
+        self.t_last = t_now
+
+    def report(self, file=sys.stderr):
+        if not self.enabled:
+            return
+        for name, dt in self.l_stages:
+            print("# profile: %-10s %8.2f ms" % (name, dt * 1000), file=file)
+        print("# profile: %-10s %8.2f ms (%d modules loaded)" %
+              ("total", (self.t_last - T_START) * 1000, len(sys.modules)), file=file)
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import shutil
+import time
+import numpy as np
+
+
+# some class
+class SeriesCache:
+    # on-disk cache of fetched series: one directory by measurement/field/step with .npy segments
+    # (timestamps and values) and a small json index, segments are read as memory-mapped arrays
+    def __init__(self, root, max_bytes=256 << 20, seg_size=1 << 16, atime_step=60.0):
+        self.root = root
+        # total cache size limit (least recently used series are evicted), None for no limit
+        self.max_bytes = max_bytes
+        # max samples by segment, the last segment is rewritten until it is full
+        self.seg_size = seg_size
+        # series access time resolution (s): a read rewrite the series index at most once by atime_step
+        self.atime_step = atime_step
+        # segments size total: counted on first use, then kept up to date by append and evict
+        self.n_bytes = None
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key, *args):
+        measurement, field, ts = key
+        return os.path.join(self.root, measurement, "%s@%ds" % (field, ts), *args)
+
+    def _load_index(self, key):
+        try:
+            with open(self._path(key, "index.json")) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {"segments": [], "atime": 0.0}
+
+    def _save_index(self, key, index):
+        # atomic update: write a temporary file then rename it
+        index["atime"] = time.time()
+        tmp_path = self._path(key, "index.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self._path(key, "index.json"))
+
+    def head(self, key):
+        # timestamp of the first cached sample (None if series is not cached)
+        segments = self._load_index(key)["segments"]
+        return segments[0]["t0"] if segments else None
+
+    def is_complete(self, key):
+        # True if the cached history reaches the start of the series data (nothing older to fetch)
+        return self._load_index(key).get("complete", False)
+
+    def tail(self, key):
+        # timestamp of the last cached sample (None if series is not cached)
+        segments = self._load_index(key)["segments"]
+        return segments[-1]["t1"] if segments else None
+
+    def append(self, key, t_samples, y_samples, is_start=False):
+        # add samples (chronological order) to a series, cached samples at or after t_samples[0] are replaced
+        # is_start: t_samples[0] is the first bucket of the series data
+        if not len(t_samples):
+            return
+        os.makedirs(self._path(key), exist_ok=True)
+        index = self._load_index(key)
+        if is_start:
+            index["complete"] = True
+        segments = index["segments"]
+        # size change of the cache
+        delta = 0
+        # drop overlapped samples (last bucket may have been partial when it was cached)
+        while segments and segments[-1]["t0"] >= t_samples[0]:
+            delta -= self._remove_segment(key, segments.pop())
+        if segments and segments[-1]["t1"] >= t_samples[0]:
+            t_seg, y_seg = self._read_segment(key, segments[-1])
+            keep = t_seg < t_samples[0]
+            t_samples = np.concatenate((t_seg[keep], t_samples))
+            y_samples = np.concatenate((y_seg[keep], y_samples))
+            delta -= self._remove_segment(key, segments.pop())
+        # fill up the last segment, then write new ones
+        elif segments and segments[-1]["n"] < self.seg_size:
+            t_seg, y_seg = self._read_segment(key, segments[-1])
+            t_samples = np.concatenate((t_seg, t_samples))
+            y_samples = np.concatenate((y_seg, y_samples))
+            delta -= self._remove_segment(key, segments.pop())
+        seg_id = segments[-1]["id"] + 1 if segments else 0
+        for i in range(0, len(t_samples), self.seg_size):
+            seg = {"id": seg_id, "t0": int(t_samples[i]), "t1": int(t_samples[i:i + self.seg_size][-1]),
+                   "n": len(t_samples[i:i + self.seg_size])}
+            np.save(self._path(key, "%06d.t.npy" % seg_id), np.asarray(t_samples[i:i + self.seg_size], dtype=np.int64))
+            np.save(self._path(key, "%06d.y.npy" % seg_id), np.asarray(y_samples[i:i + self.seg_size], dtype=float))
+            delta += sum(os.path.getsize(self._path(key, "%06d.%s.npy" % (seg_id, ext))) for ext in ("t", "y"))
+            segments.append(seg)
+            seg_id += 1
+        self._save_index(key, index)
+        if self.n_bytes is not None:
+            self.n_bytes += delta
+        # the cache tree is only walked when the size limit is exceeded
+        if self.max_bytes is not None and self.size() > self.max_bytes:
+            self.evict()
+
+    def read(self, key, t_min=None, t_max=None):
+        # return cached timestamps and values with t_min <= t <= t_max
+        # a range inside a single segment is returned as a memory-mapped (zero-copy) view
+        index = self._load_index(key)
+        l_t, l_y = [], []
+        for seg in index["segments"]:
+            if (t_min is not None and seg["t1"] < t_min) or (t_max is not None and seg["t0"] > t_max):
+                continue
+            t_seg, y_seg = self._read_segment(key, seg)
+            i0 = 0 if t_min is None else np.searchsorted(t_seg, t_min)
+            i1 = len(t_seg) if t_max is None else np.searchsorted(t_seg, t_max, side="right")
+            l_t.append(t_seg[i0:i1])
+            l_y.append(y_seg[i0:i1])
+        if index["segments"] and time.time() - index.get("atime", 0.0) > self.atime_step:
+            self._save_index(key, index)
+        if not l_t:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        if len(l_t) == 1:
+            return l_t[0], l_y[0]
+        return np.concatenate(l_t), np.concatenate(l_y)
+
+    def _read_segment(self, key, seg):
+        return (np.load(self._path(key, "%06d.t.npy" % seg["id"]), mmap_mode="r"),
+                np.load(self._path(key, "%06d.y.npy" % seg["id"]), mmap_mode="r"))
+
+    def _remove_segment(self, key, seg):
+        # remove segment files, return their size
+        size = 0
+        for ext in ("t", "y"):
+            try:
+                path = self._path(key, "%06d.%s.npy" % (seg["id"], ext))
+                size += os.path.getsize(path)
+                os.remove(path)
+            except OSError:
+                pass
+        return size
+
+    def _series_dirs(self):
+        # walk the cache tree: (atime, segments size, directory) of every cached series
+        l_dirs = []
+        for dir_path, _, files in os.walk(self.root):
+            if "index.json" in files:
+                try:
+                    with open(os.path.join(dir_path, "index.json")) as f:
+                        atime = json.load(f).get("atime", 0.0)
+                    size = sum(os.path.getsize(os.path.join(dir_path, f)) for f in files if f.endswith(".npy"))
+                except (OSError, ValueError):
+                    continue
+                l_dirs.append((atime, size, dir_path))
+        return l_dirs
+
+    def size(self):
+        # segments size total of the cache
+        if self.n_bytes is None:
+            self.n_bytes = sum(size for _, size, _ in self._series_dirs())
+        return self.n_bytes
+
+    def evict(self, max_bytes=None):
+        # remove least recently used series if cache size is over max_bytes (default: cache limit), down to
+        # 90 % of it so that the next appends don't evict again
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        if max_bytes is None:
+            return
+        l_dirs = self._series_dirs()
+        self.n_bytes = sum(size for _, size, _ in l_dirs)
+        if self.n_bytes <= max_bytes:
+            return
+        for atime, size, dir_path in sorted(l_dirs):
+            if self.n_bytes <= 0.9 * max_bytes:
+                break
+            shutil.rmtree(dir_path, ignore_errors=True)
+            self.n_bytes -= size
+
+
+# some functions
+def fetch_cached(source, cache, measurement, fields, ts=10, nb=400):
+    # same result as source.fetch (last nb buckets) but query only buckets newer than cache tail
+    keys = [(measurement, f, ts) for f in fields]
+    tails = [cache.tail(k) for k in keys]
+    heads = [cache.head(k) for k in keys]
+    # refetch the last cached bucket: it may have been partial
+    t_min = None if None in tails else min(tails)
+    # cache doesn't cover the window: full fetch (unless the cached history starts with the series data)
+    if t_min is not None and any(h > t_min - (nb - 1) * ts and not cache.is_complete(k) for k, h in zip(keys, heads)):
+        t_min = None
+    t_new, y_new = source.fetch(measurement, fields, ts=ts, nb=nb, t_min=t_min)
+    # a full fetch shorter than the window returned the whole history
+    is_start = t_min is None and len(t_new) < nb
+    for key, y in zip(keys, y_new):
+        cache.append(key, t_new, y, is_start=is_start)
+    # build the window from cache, samples are placed by timestamp (missing ones are nan)
+    tails = [t for t in (cache.tail(k) for k in keys) if t is not None]
+    if not tails:
+        return np.empty(0, dtype=np.int64), np.empty((len(fields), 0))
+    t_start = max(tails) - (nb - 1) * ts
+    t_samples = t_start + ts * np.arange(nb, dtype=np.int64)
+    y_samples = np.full((len(fields), nb), np.nan)
+    t_first = t_samples[-1]
+    for i, key in enumerate(keys):
+        t, y = cache.read(key, t_min=t_start)
+        y_samples[i, (t - t_start) // ts] = y
+        if len(t):
+            t_first = min(t_first, t[0])
+    # skip buckets before the oldest cached one (a short history give a short window, like a direct fetch)
+    keep = t_samples >= t_first
+    return t_samples[keep], y_samples[:, keep]
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import fnmatch
+from datasource import open_source
+
+
+# worker process context (one data source connection and cache by process)
+class Worker:
+    source = None
+    cache = None
+
+
+# some functions
+def init_worker(source_url, cache_dir=None, cache_size=None):
+    # cache_size (MB) is the cache limit of this process, None for a pool worker: workers share the cache
+    # directory, so only the parent evict (after the pool is done) to never remove a series in use
+    Worker.source = open_source(source_url)
+    if cache_dir:
+        # cache module is only loaded when a cache is used
+        from ts_cache import SeriesCache
+        Worker.cache = SeriesCache(cache_dir, max_bytes=None if cache_size is None else cache_size << 20)
+
+
+def worker_fetch(measurement, fields, ts=10, nb=400):
+    # fetch fields of a measurement with the worker source (through the cache if any)
+    if Worker.cache:
+        from ts_cache import fetch_cached
+        return fetch_cached(Worker.source, Worker.cache, measurement, fields, ts=ts, nb=nb)
+    return Worker.source.fetch(measurement, fields, ts=ts, nb=nb)
+
+
+def expand_targets(source, targets):
+    # turn "measurement:field" patterns (glob allowed) into a {measurement: [fields]} dict
+    d_targets = {}
+    measurements = None
+    for target in targets:
+        m_pattern, _, f_pattern = target.partition(":")
+        f_pattern = f_pattern or "*"
+        if any(c in m_pattern for c in "*?["):
+            if measurements is None:
+                measurements = source.measurements()
+            l_measurements = fnmatch.filter(measurements, m_pattern)
+        else:
+            l_measurements = [m_pattern]
+        for measurement in l_measurements:
+            if any(c in f_pattern for c in "*?["):
+                l_fields = fnmatch.filter(source.fields(measurement), f_pattern)
+            else:
+                l_fields = [f_pattern]
+            d_fields = d_targets.setdefault(measurement, [])
+            d_fields.extend(f for f in l_fields if f not in d_fields)
+    return d_targets